@@ -0,0 +1,136 @@
+"""UI の静的アセット (CSS・選択肢・サンプルメール)
+
+Streamlit はウィジェット操作のたびにメインスクリプトだけを再実行するため、
+ここに置いた定数はプロセスごとに 1 回だけ評価される。
+"""
+
+# カスタムCSS
+CUSTOM_CSS = """
+<style>
+    .main-header {color: #000000; font-size: 2.5rem !important; font-weight: 700; margin-bottom: 1rem;}
+    .sub-header {color: #333333; font-size: 1.8rem !important; font-weight: 600; margin-top: 1rem;}
+    .info-text {font-size: 1.1rem; color: #000000;}
+    .highlight {background-color: #f0f0f0; padding: 1rem; border-radius: 0.5rem; margin: 1rem 0;}
+    .success-box {background-color: #f0f0f0; padding: 1rem; border-radius: 0.5rem; border-left: 5px solid #333333;}
+    .info-box {background-color: #f5f5f5; padding: 1rem; border-radius: 0.5rem; border-left: 5px solid #555555;}
+    .btn-custom {background-color: #333333 !important; color: white !important; font-weight: 600 !important;}
+    .footer {font-size: 0.8rem; color: #333333; text-align: center; margin-top: 2rem;}
+    .card {background-color: #f9f9f9; border-radius: 0.5rem; padding: 1.5rem; box-shadow: 0 2px 5px rgba(0,0,0,0.1);}
+    code {font-family: 'Courier New', monospace !important;}
+    pre {background-color: #f5f5f5; padding: 0.5rem; border-radius: 0.3rem;}
+    li {margin-bottom: 0.5rem;}
+    textarea, input {font-family: 'Courier New', monospace !important;}
+</style>
+"""
+
+MODELS = ["gpt-4.1", "gpt-4o", "gpt-4o-mini", "gpt-3.5-turbo"]
+LANGUAGES = ["日本語", "English", "简体中文", "한국어"]
+
+# サンプルメール
+SAMPLE_EMAILS = {
+    "ビジネスメール (丁寧)": """拝啓
+
+平素より格別のご高配を賜り、厚く御礼申し上げます。
+株式会社〇〇の山田太郎でございます。
+
+先日はご多忙の中、弊社製品についてご検討いただき誠にありがとうございました。
+ご要望いただいた資料を添付させていただきます。
+
+ご不明な点がございましたら、お気軽にお問い合わせください。
+今後とも何卒よろしくお願い申し上げます。
+
+敬具""",
+    "カジュアルな連絡": """こんにちは山田さん
+
+先日はありがとうございました！
+打ち合わせの件ですが、来週の水曜日15時からでよろしいでしょうか？
+
+ご都合を教えてくださいm(_ _)m
+よろしくお願いします！
+
+田中""",
+    "お詫びメール": """件名: 【お詫び】納品遅延について
+
+○○様
+
+いつもお世話になっております。
+株式会社△△の佐藤でございます。
+
+先日ご注文いただきました商品の納期遅延につきまして、
+心よりお詫び申し上げます。
+
+当初の予定では本日お届けの予定でしたが、
+生産ラインの一部トラブルにより3営業日ほど遅れる見込みとなりました。
+
+ご迷惑をおかけし大変申し訳ございません。
+今後このようなことがないよう、生産体制を見直してまいります。
+
+何卒ご理解いただきますようお願い申し上げます。
+
+株式会社△△
+佐藤一郎
+TEL: 03-XXXX-XXXX""",
+    "お礼メール": """鈴木様
+
+先日はお忙しい中、当社イベントにご参加いただき誠にありがとうございました。
+おかげさまで、大盛況のうちに終えることができました。
+
+ご提供いただいたフィードバックは、今後の企画に活かしてまいります。
+引き続きご支援いただけますと幸いです。
+
+今後ともどうぞよろしくお願いいたします。
+
+佐々木""",
+    "社内連絡 (報告)": """部長
+
+先週依頼いただいた四半期レポートの進捗状況をご報告いたします。
+
+【完了項目】
+・売上データの集計
+・前年同期との比較分析
+・部門別実績まとめ
+
+【作業中】
+・グラフ作成と考察（70%完了）
+・来期予測（30%完了）
+
+すべて予定通り進んでおり、週末までには完成版をお送りできる見込みです。
+何かご質問やご指示がありましたら、お知らせください。
+
+伊藤""",
+    "スケジュール調整": """チームのみなさん
+
+来週のプロジェクトミーティングの日程調整をしたいと思います。
+下記の候補日時から都合の良い時間をお知らせください。
+
+①月曜日 10:00-11:30
+②火曜日 13:00-14:30
+③水曜日 15:00-16:30
+
+アジェンダは以下の通りです。
+1. 現在の進捗確認（15分）
+2. 課題の洗い出しと解決策検討（30分）
+3. 次のマイルストーン設定（15分）
+4. 質疑応答（15分）
+
+参加できない場合は事前にコメントをいただけると助かります。
+よろしくお願いします。
+
+プロジェクトリーダー 小林""",
+    "案内・招待": """山本様
+
+来る6月15日(土)に当社創立10周年記念パーティーを開催することとなりました。
+日頃お世話になっている山本様にもぜひご出席いただきたく、ご案内申し上げます。
+
+【日時】6月15日(土) 18:00-20:30
+【場所】グランドホテル東京 2階「桜の間」
+【内容】軽食ビュッフェ、記念スピーチ、アトラクション等
+
+ご多忙中誠に恐縮ですが、6月5日(水)までにご出欠のご連絡をいただけますと幸いです。
+お会いできることを心よりお待ちしております。
+
+株式会社○○
+イベント担当 高橋
+TEL: 03-XXXX-XXXX
+Email: event@xxxx.co.jp"""
+}
@@ -0,0 +1,292 @@
+"""スタイル抽出・メール生成のヘッドレス一括実行 CLI
+
+使い方:
+    python app/batch_cli.py extract --input mails/ --output styles.jsonl --concurrency 16
+    python app/batch_cli.py extract --input export.mbox --output styles.jsonl
+    python app/batch_cli.py generate --input requests.jsonl --style-rules rules.txt --output emails.jsonl
+
+API キーは環境変数 OPENAI_API_KEY から読み込む。結果は入力順に JSONL へ逐次追記され、
+再実行時は出力済み (エラーなし) のレコードをスキップするため、中断後もそのまま再開できる。
+再開した場合は終了時に出力を書き直し、ID ごとに最後の結果だけを残す。
+"""
+import argparse
+import asyncio
+import email
+import email.policy
+import json
+import mailbox
+import os
+import sys
+import time
+
+from openai import AsyncOpenAI
+
+from llm import SYSTEM_EXTRACT, SYSTEM_GENERATE, achat_completion, build_messages
+from metrics import DEFAULT_METRICS_LOG, Metrics, start_call
+from preprocess import DEFAULT_TOKEN_BUDGET, preprocess_email
+from prompt_templates import EMAIL_PURPOSES, render_generate_prompt, render_style_prompt
+from response_cache import ResponseCache
+
+EMAIL_SUFFIXES = (".txt", ".eml")
+
+
+# --- 入力の読み込み ------------------------------------------------------
+def _message_text(msg):
+    """email.message.EmailMessage から本文 (text/plain) を取り出す"""
+    part = msg.get_body(preferencelist=("plain",)) if hasattr(msg, "get_body") else None
+    if part is None:
+        payload = msg.get_payload(decode=True)
+        return payload.decode(msg.get_content_charset() or "utf-8", errors="replace") if payload else ""
+    return part.get_content()
+
+
+def read_directory(path):
+    for root, _dirs, files in os.walk(path):
+        for name in sorted(files):
+            if not name.endswith(EMAIL_SUFFIXES):
+                continue
+            file_path = os.path.join(root, name)
+            record_id = os.path.relpath(file_path, path)
+            if name.endswith(".eml"):
+                with open(file_path, "rb") as f:
+                    msg = email.message_from_binary_file(f, policy=email.policy.default)
+                yield {"id": record_id, "text": _message_text(msg)}
+            else:
+                with open(file_path, encoding="utf-8", errors="replace") as f:
+                    yield {"id": record_id, "text": f.read()}
+
+
+def read_mbox(path):
+    box = mailbox.mbox(path, factory=lambda f: email.message_from_binary_file(f, policy=email.policy.default))
+    for i, msg in enumerate(box):
+        yield {"id": msg.get("Message-ID") or f"{os.path.basename(path)}#{i}", "text": _message_text(msg)}
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault("id", str(i))
+            record["id"] = str(record["id"])
+            if "text" not in record and "email" in record:
+                record["text"] = record["email"]
+            yield record
+
+
+def read_records(path):
+    if os.path.isdir(path):
+        return read_directory(path)
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_mbox(path)
+
+
+def load_done_ids(output_path):
+    """出力ファイルから完了済み (error なし) のレコード ID を集める"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 書き込み途中でクラッシュした末尾行
+                continue
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+def compact_output(output_path):
+    """再開で追記された出力を、ID ごとに最後の行だけを残して書き直す (並びは最初に出力された順)"""
+    rows = {}
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # 既存のキーへの代入は順序を変えないため、並びは最初に出力された順のまま
+            rows[record["id"]] = line if line.endswith("\n") else line + "\n"
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(rows.values())
+    os.replace(tmp_path, output_path)
+
+
+# --- 実行 ----------------------------------------------------------------
+class OrderedWriter:
+    """完了順に届く結果を入力順に並べ替えて JSONL に書き出す"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.pending = {}
+        self.next_index = 0
+
+    def put(self, index, record):
+        self.pending[index] = record
+        while self.next_index in self.pending:
+            self.fp.write(json.dumps(self.pending.pop(self.next_index), ensure_ascii=False) + "\n")
+            self.next_index += 1
+        self.fp.flush()
+
+
+async def run_batch(records, worker, writer, concurrency):
+    """worker を最大 concurrency 並列で実行し、結果を writer へ入力順に渡す
+
+    先頭の遅いレコードで並べ替えバッファが膨らまないよう、未書き出しの件数も
+    concurrency の数倍までに抑える。戻り値は (成功件数, 失敗件数)。
+    """
+    window = concurrency * 4
+    sem = asyncio.Semaphore(concurrency)
+    advanced = asyncio.Condition()
+    counts = {"ok": 0, "failed": 0}
+
+    async def run(index, record):
+        try:
+            result = await worker(record)
+            counts["ok"] += 1
+        except Exception as e:
+            result = {"id": record["id"], "error": f"{type(e).__name__}: {e}"}
+            counts["failed"] += 1
+        finally:
+            sem.release()
+        writer.put(index, result)
+        async with advanced:
+            advanced.notify_all()
+
+    tasks = set()
+    for index, record in enumerate(records):
+        async with advanced:
+            await advanced.wait_for(lambda: index - writer.next_index < window)
+        await sem.acquire()
+        task = asyncio.create_task(run(index, record))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return counts["ok"], counts["failed"]
+
+
+def make_worker(args, client, cache, metrics=None):
+    if args.mode == "extract":
+        async def worker(record):
+            call = start_call(metrics, "extract", args.model)
+            text = record["text"]
+            with call.stage("render"):
+                if args.preprocess:
+                    text = preprocess_email(text, args.token_budget).text
+                messages = build_messages(SYSTEM_EXTRACT, render_style_prompt(text))
+            res = await achat_completion(
+                client, model=args.model, messages=messages, cache=cache, record=call, temperature=0.3
+            )
+            return {"id": record["id"], "style_rules": res.content, "usage": res.usage, "cached": res.cached}
+        return worker
+
+    default_rules = None
+    if args.style_rules:
+        with open(args.style_rules, encoding="utf-8") as f:
+            default_rules = f.read()
+
+    async def worker(record):
+        style_rules = record.get("style_rules") or default_rules
+        if not style_rules:
+            raise ValueError("style_rules がありません (--style-rules またはレコードの style_rules を指定してください)")
+        call = start_call(metrics, "generate", args.model)
+        with call.stage("render"):
+            prompt = render_generate_prompt(
+                style_rules,
+                record["request"],
+                recipient=record.get("recipient", ""),
+                formality=record.get("formality", args.formality),
+                length=record.get("length", args.length),
+                purpose=record.get("purpose", args.purpose),
+            )
+        res = await achat_completion(
+            client,
+            model=args.model,
+            messages=build_messages(SYSTEM_GENERATE, prompt),
+            cache=cache,
+            record=call,
+            temperature=args.temperature,
+            max_tokens=args.max_tokens,
+        )
+        return {"id": record["id"], "email": res.content, "usage": res.usage, "cached": res.cached}
+    return worker
+
+
+async def main_async(args):
+    done = load_done_ids(args.output) if args.resume else set()
+    skipped = 0
+
+    def pending_records():
+        nonlocal skipped
+        for record in read_records(args.input):
+            if record["id"] in done:
+                skipped += 1
+                continue
+            yield record
+
+    client = AsyncOpenAI(max_retries=args.max_retries)
+    cache = None if args.no_cache else ResponseCache()
+    metrics = Metrics(log_path=args.metrics_log)
+    started = time.perf_counter()
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as fp:
+        worker = make_worker(args, client, cache, metrics)
+        ok, failed = await run_batch(pending_records(), worker, OrderedWriter(fp), args.concurrency)
+    elapsed = time.perf_counter() - started
+    await client.close()
+    if args.resume:
+        # 失敗して再実行したレコードの古い行 (error) を取り除き、1 ID 1 行にする
+        compact_output(args.output)
+
+    summary = {
+        "mode": args.mode,
+        "model": args.model,
+        "concurrency": args.concurrency,
+        "processed": ok,
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed_sec": round(elapsed, 3),
+        "emails_per_sec": round((ok + failed) / elapsed, 3) if elapsed > 0 else 0.0,
+        "calls": metrics.summary(),
+    }
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="メールスタイル抽出・メール生成の一括実行")
+    parser.add_argument("mode", choices=["extract", "generate"])
+    parser.add_argument("--input", required=True, help="メールのディレクトリ (.txt/.eml)、mbox ファイル、または JSONL")
+    parser.add_argument("--output", required=True, help="結果を書き出す JSONL")
+    parser.add_argument("--model", default="gpt-4.1")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に実行するリクエスト数 (1 で UI と同じ逐次実行)")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="出力ファイルを上書きして最初から実行する")
+    parser.add_argument("--no-cache", action="store_true", help="応答キャッシュを使わない")
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--no-preprocess", dest="preprocess", action="store_false",
+                        help="extract で引用・重複署名・重複メールの除去を行わない")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="前処理後の入力の最大トークン数")
+    parser.add_argument("--metrics-log", default=DEFAULT_METRICS_LOG,
+                        help="API 呼び出しごとの計測値を追記する JSONL (既定は MAIL_GPT_METRICS_LOG)")
+    # generate 用
+    parser.add_argument("--style-rules", help="文体ルールのテキストファイル (レコードに style_rules がない場合に使用)")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--formality", type=int, default=3)
+    parser.add_argument("--length", default="標準")
+    parser.add_argument("--purpose", default=EMAIL_PURPOSES[0], choices=EMAIL_PURPOSES)
+    args = parser.parse_args(argv)
+    if args.mode == "generate" and not args.input.endswith(".jsonl"):
+        parser.error("generate には request フィールドを持つ JSONL を指定してください")
+    if args.concurrency < 1:
+        parser.error("--concurrency は 1 以上を指定してください")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args()))
@@ -0,0 +1,119 @@
+"""軽量モデル優先の段階実行 (カスケード) と、抽出結果のローカル検証
+
+style_rules_prompt.jinja2 の出力条件 (8〜12 行・各行 "- " 始まり・原文を転載しない) は
+API を呼ばずに検査できる。まず軽量モデルで抽出し、検証に通らなかった場合だけ上位モデルで再実行する。
+"""
+import os
+import statistics
+import threading
+import time
+
+CASCADE_MODEL = os.environ.get("MAIL_GPT_CASCADE_MODEL", "gpt-4o-mini")
+MIN_LINES = 8
+MAX_LINES = 12
+NGRAM = 8              # 転載判定に使う文字 n-gram の長さ
+MAX_LINE_OVERLAP = 0.5  # 1 行の n-gram のうち原文と一致する割合がこれ以上なら転載とみなす
+
+
+def _ngrams(text, n=NGRAM):
+    compact = "".join(text.split())
+    return {compact[i:i + n] for i in range(len(compact) - n + 1)}
+
+
+def validate_rules(text, source, min_lines=MIN_LINES, max_lines=MAX_LINES):
+    """抽出結果の問題点を日本語のリストで返す (空なら合格)"""
+    problems = []
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not min_lines <= len(lines) <= max_lines:
+        problems.append(f"行数が {len(lines)} 行です ({min_lines}〜{max_lines} 行が必要)")
+    bad_prefix = [i + 1 for i, line in enumerate(lines) if not line.startswith("- ")]
+    if bad_prefix:
+        problems.append(f"{', '.join(map(str, bad_prefix[:5]))} 行目が \"- \" で始まっていません")
+    source_grams = _ngrams(source)
+    copied = []
+    for i, line in enumerate(lines):
+        grams = _ngrams(line[2:] if line.startswith("- ") else line)
+        if grams and len(grams & source_grams) / len(grams) >= MAX_LINE_OVERLAP:
+            copied.append(i + 1)
+    if copied:
+        problems.append(f"{', '.join(map(str, copied[:5]))} 行目がメール本文の転載です")
+    return problems
+
+
+def cascade_tiers(model):
+    """選択中のモデルに対する段階実行の順序 (軽量モデルと同じなら 1 段のみ)"""
+    return [model] if model == CASCADE_MODEL else [CASCADE_MODEL, model]
+
+
+def run_cascade(tiers, attempt, validate, stats=None):
+    """tiers のモデルで順に attempt(model) を実行し、validate に通った最初の Completion を返す
+
+    最後の段は検証に通らなくても結果を採用する。戻り値は (Completion, 採用したモデル, [(モデル, 問題点)])。
+    1 段だけの場合は段階実行ではないため、stats にはそのモデル単独の所要時間 (短縮時間の基準) として記録する。
+    """
+    started = time.perf_counter()
+    history = []
+    for i, model in enumerate(tiers):
+        tier_started = time.perf_counter()
+        res = attempt(model)
+        problems = validate(res.content)
+        history.append((model, problems))
+        if stats is not None and not res.cached and len(tiers) > 1:
+            stats.record_attempt(model, not problems, (time.perf_counter() - tier_started) * 1000)
+        if not problems or i == len(tiers) - 1:
+            if stats is not None and not res.cached:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if len(tiers) > 1:
+                    stats.record_request(tiers[-1], elapsed_ms)
+                else:
+                    stats.record_baseline(model, elapsed_ms)
+            return res, model, history
+
+
+class CascadeStats:
+    """段階ごとの合格率と、上位モデルだけを使った場合と比べた平均短縮時間 (スレッドセーフ)"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._tiers = {}      # model -> {"attempts", "passed", "latencies"}
+        self._requests = []   # (上位モデル, カスケード全体の所要時間 ms)
+        self._baselines = {}  # model -> [段階実行なしで実行した所要時間 ms]
+        self._lock = threading.Lock()
+
+    def record_attempt(self, model, passed, latency_ms):
+        with self._lock:
+            tier = self._tiers.setdefault(model, {"attempts": 0, "passed": 0, "latencies": []})
+            tier["attempts"] += 1
+            tier["passed"] += int(passed)
+            tier["latencies"] = (tier["latencies"] + [latency_ms])[-self.window:]
+
+    def record_request(self, top_model, latency_ms):
+        with self._lock:
+            self._requests = (self._requests + [(top_model, latency_ms)])[-self.window:]
+
+    def record_baseline(self, model, latency_ms):
+        with self._lock:
+            self._baselines[model] = (self._baselines.get(model, []) + [latency_ms])[-self.window:]
+
+    def summary(self):
+        with self._lock:
+            tiers = {
+                model: {
+                    "attempts": t["attempts"],
+                    "passed": t["passed"],
+                    "success_rate": t["passed"] / t["attempts"] if t["attempts"] else None,
+                    "mean_latency_ms": statistics.fmean(t["latencies"]) if t["latencies"] else None,
+                }
+                for model, t in self._tiers.items()
+            }
+            baselines = {model: statistics.fmean(v) for model, v in self._baselines.items()}
+            requests = list(self._requests)
+        # 上位モデルを段階実行なしで使ったときの平均所要時間と比べる
+        # (段階実行で上位モデルまで進んだ回だけの平均は、軽量モデルが常に合格すると得られないため使わない)
+        saved = [baselines[top] - latency for top, latency in requests if top in baselines]
+        return {
+            "tiers": tiers,
+            "requests": len(requests),
+            "baseline_ms": baselines,
+            "mean_saved_ms": statistics.fmean(saved) if saved else None,
+        }
@@ -0,0 +1,156 @@
+"""API キー・ベース URL ごとに OpenAI クライアントを使い回すプール
+
+クライアント (と内部の httpx コネクションプール) を Streamlit の再実行・セッションを
+またいで保持し、keep-alive 接続を再利用して TLS ハンドシェイクを省く。
+キーは API キーのハッシュなので、同じキーを入力したセッション以外には共有されない。
+追い出したクライアントは他のスレッド・リクエストが使用中の場合があるため閉じずに手放し、
+使われなくなってガベージコレクションされたときに接続を閉じる。
+openai / httpx は最初にクライアントを作るときに import し、起動を軽くしている。
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get("MAIL_GPT_POOL_MAX_CONNECTIONS", "20"))
+DEFAULT_MAX_KEEPALIVE = int(os.environ.get("MAIL_GPT_POOL_MAX_KEEPALIVE", "10"))
+DEFAULT_KEEPALIVE_EXPIRY = float(os.environ.get("MAIL_GPT_POOL_KEEPALIVE_EXPIRY", "60"))
+DEFAULT_TIMEOUT = float(os.environ.get("MAIL_GPT_HTTP_TIMEOUT", "120"))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get("MAIL_GPT_HTTP_CONNECT_TIMEOUT", "10"))
+DEFAULT_IDLE_TTL = float(os.environ.get("MAIL_GPT_CLIENT_IDLE_TTL", "900"))
+DEFAULT_MAX_CLIENTS = int(os.environ.get("MAIL_GPT_MAX_CLIENTS", "256"))
+DEFAULT_CLIENT_MAX_RETRIES = int(os.environ.get("MAIL_GPT_CLIENT_MAX_RETRIES", "2"))
+
+
+def _pool_key(api_key, base_url):
+    return hashlib.sha256(f"{base_url or ''}\0{api_key}".encode("utf-8")).hexdigest()
+
+
+class ClientPool:
+    """スレッドセーフな OpenAI クライアントのキャッシュ (アイドル時間と件数で追い出す)"""
+
+    def __init__(
+        self,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        max_keepalive=DEFAULT_MAX_KEEPALIVE,
+        keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+        timeout=DEFAULT_TIMEOUT,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        idle_ttl=DEFAULT_IDLE_TTL,
+        max_clients=DEFAULT_MAX_CLIENTS,
+        max_retries=DEFAULT_CLIENT_MAX_RETRIES,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.idle_ttl = idle_ttl
+        self.max_clients = max_clients
+        self.max_retries = max_retries
+        self._clients = {}  # pool_key -> [client, last_used]
+        self._lock = threading.Lock()
+
+    def get(self, api_key, base_url=None):
+        """api_key / base_url 専用のクライアントを返す (なければ作成する)"""
+        base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+        key = _pool_key(api_key, base_url)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                self._evict_oldest(len(self._clients) - self.max_clients + 1)
+                entry = self._clients[key] = [self._create(api_key, base_url), now]
+            entry[1] = now
+            return entry[0]
+
+    def _http_settings(self):
+        """(httpx.Timeout, httpx.Limits) を返す (同期・非同期のプールで共通)"""
+        import httpx
+
+        timeout = httpx.Timeout(self.timeout, connect=self.connect_timeout)
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        return timeout, limits
+
+    def _create(self, api_key, base_url):
+        import httpx
+        from openai import OpenAI
+
+        timeout, limits = self._http_settings()
+        http_client = httpx.Client(limits=limits, timeout=timeout)
+        client = OpenAI(
+            api_key=api_key, base_url=base_url, timeout=timeout, max_retries=self.max_retries, http_client=http_client
+        )
+        weakref.finalize(client, http_client.close)
+        return client
+
+    def __len__(self):
+        return len(self._clients)
+
+    def close(self):
+        """プール内のすべてのクライアントを閉じる (終了時に、使用中のリクエストがない状態で呼ぶ)"""
+        with self._lock:
+            for client, _ in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def _evict_idle(self, now):
+        for k in [k for k, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]:
+            del self._clients[k]
+
+    def _evict_oldest(self, count):
+        if count <= 0:
+            return
+        by_age = sorted(self._clients, key=lambda k: self._clients[k][1])
+        for k in by_age[:count]:
+            del self._clients[k]
+
+
+class AsyncClientPool(ClientPool):
+    """AsyncOpenAI 版の ClientPool (service.py 用)。イベントループのスレッドからのみ使う"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._closing = set()  # 手放したクライアントの接続を閉じているタスク
+
+    def _create(self, api_key, base_url):
+        import httpx
+        from openai import AsyncOpenAI
+
+        timeout, limits = self._http_settings()
+        http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, timeout=timeout, max_retries=self.max_retries, http_client=http_client
+        )
+        weakref.finalize(client, self._close_later, http_client, self._closing)
+        return client
+
+    @staticmethod
+    def _close_later(http_client, closing):
+        # ガベージコレクション中は await できないため、イベントループのタスクとして閉じる
+        # (タスクは完了まで closing で参照を保持する)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(http_client.aclose())
+        closing.add(task)
+        task.add_done_callback(closing.discard)
+
+    def close(self):
+        raise TypeError("AsyncClientPool は await aclose() で閉じてください")
+
+    async def aclose(self):
+        with self._lock:
+            clients = [client for client, _ in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            await client.close()
+        await asyncio.gather(*self._closing)
@@ -0,0 +1,141 @@
+"""複数メール (コーパス) からの map-reduce 型スタイル抽出
+
+1. map: コーパスをメール単位・トークン数上限のチャンクに分割し、部分ルールを並列に抽出する
+2. reduce: 部分ルールを fan_in 件ずつ並列に統合し、最後に 1 回の統合で 8〜12 行のルールにする
+
+所要時間はコーパスの大きさではなく、各段の最も遅いリクエストと段数 (log_fan_in) で決まる。
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from llm import SYSTEM_EXTRACT, Completion, build_messages, chat_completion
+from metrics import start_call
+from prompt_templates import render_merge_prompt, render_style_prompt
+from tokens import estimate_tokens
+
+DEFAULT_CHUNK_TOKENS = 3000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_FAN_IN = 8
+
+# メール同士の区切り線 (---, ===, ___, ### を 3 文字以上)
+EMAIL_SEPARATOR = re.compile(r"^\s*(?:-{3,}|={3,}|_{3,}|#{3,})\s*$", re.MULTILINE)
+
+
+def split_emails(text):
+    """区切り線でメールごとに分割する (区切りがなければ全体を 1 通として扱う)"""
+    return [part.strip() for part in EMAIL_SEPARATOR.split(text) if part.strip()]
+
+
+def _split_oversized(text, max_tokens):
+    """1 通で上限を超えるメールを段落 → 行 → 文字数の順に分割する"""
+    for separator in ("\n\n", "\n"):
+        pieces = text.split(separator)
+        if len(pieces) > 1:
+            return _pack(pieces, max_tokens, separator)
+    step = max(1, max_tokens)
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _pack(pieces, max_tokens, separator):
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_oversized(piece, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_corpus(text, chunk_tokens=DEFAULT_CHUNK_TOKENS):
+    """コーパスを、メールの境界をできるだけ保ったまま chunk_tokens 以下のチャンクにまとめる"""
+    return _pack(split_emails(text), chunk_tokens, "\n\n---\n\n")
+
+
+def merge_usage(completions):
+    usage = {}
+    for completion in completions:
+        for name, value in completion.usage.items():
+            usage[name] = usage.get(name, 0) + value
+    return usage
+
+
+def _call(client, model, render, kind, metrics, cache, params):
+    record = start_call(metrics, kind, model)
+    with record.stage("render"):
+        prompt = render()
+    return chat_completion(
+        client, model=model, messages=build_messages(SYSTEM_EXTRACT, prompt), cache=cache, record=record, **params
+    )
+
+
+def _parallel(client, model, renders, kind, max_workers, cache, on_progress, metrics, params):
+    """renders (プロンプトを返す関数) の各リクエストを並列に実行し、入力順の Completion リストを返す"""
+    results = [None] * len(renders)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_call, client, model, render, kind, metrics, cache, params): i
+            for i, render in enumerate(renders)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if on_progress is not None:
+                on_progress(done, len(renders))
+    return results
+
+
+def map_extract(client, model, chunks, max_workers=DEFAULT_MAX_WORKERS, cache=None, on_progress=None, metrics=None,
+                **params):
+    """各チャンクから部分ルールを並列に抽出する"""
+    renders = [partial(render_style_prompt, chunk) for chunk in chunks]
+    return _parallel(client, model, renders, "extract_map", max_workers, cache, on_progress, metrics, params)
+
+
+def reduce_partials(client, model, partials, fan_in=DEFAULT_FAN_IN, max_workers=DEFAULT_MAX_WORKERS,
+                    cache=None, on_progress=None, metrics=None, **params):
+    """部分ルールが fan_in 件以下になるまで、fan_in 件ずつ並列に中間統合する
+
+    戻り値は (最終統合に渡す部分ルールのリスト, 中間統合の Completion リスト)。
+    """
+    fan_in = max(2, fan_in)
+    intermediate = []
+    while len(partials) > fan_in:
+        groups = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+        renders = [partial(render_merge_prompt, group) for group in groups]
+        merged = _parallel(client, model, renders, "extract_reduce", max_workers, cache, on_progress, metrics, params)
+        intermediate.extend(merged)
+        partials = [completion.content for completion in merged]
+    return partials, intermediate
+
+
+def final_messages(partials):
+    """最終統合のメッセージ (ストリーミング表示する場合は呼び出し側で実行する)"""
+    return build_messages(SYSTEM_EXTRACT, render_merge_prompt(partials))
+
+
+def extract_corpus(client, model, text, chunk_tokens=DEFAULT_CHUNK_TOKENS, max_workers=DEFAULT_MAX_WORKERS,
+                   fan_in=DEFAULT_FAN_IN, cache=None, metrics=None, **params):
+    """コーパス全体から最終的な文体ルールを抽出する (非ストリーミング)"""
+    chunks = split_corpus(text, chunk_tokens)
+    if len(chunks) <= 1:
+        return _call(client, model, partial(render_style_prompt, text), "extract", metrics, cache, params)
+    mapped = map_extract(client, model, chunks, max_workers=max_workers, cache=cache, metrics=metrics, **params)
+    partials, intermediate = reduce_partials(
+        client, model, [c.content for c in mapped], fan_in=fan_in, max_workers=max_workers, cache=cache,
+        metrics=metrics, **params
+    )
+    final = _call(client, model, partial(render_merge_prompt, partials), "extract_merge", metrics, cache, params)
+    usage = merge_usage(mapped + intermediate + [final])
+    return Completion(final.content, usage, cached=final.cached)
@@ -1,15 +1,32 @@
-import os
-import json
-import datetime
-from openai import OpenAI
-import streamlit as st
-from jinja2 import Environment, FileSystemLoader
+import time
 
-# --- 初期設定 -----------------------------------------------------------
-BASE_DIR = os.path.dirname(__file__)
-env = Environment(loader=FileSystemLoader(os.path.join(BASE_DIR, "prompts")), autoescape=False)
+_script_started = time.perf_counter()
 
-# カスタムCSS
+import datetime
+import uuid
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from assets import CUSTOM_CSS, LANGUAGES, MODELS, SAMPLE_EMAILS
+from cascade import CASCADE_MODEL, CascadeStats, cascade_tiers, run_cascade, validate_rules
+from prompt_templates import EMAIL_PURPOSES, LENGTHS, render_generate_prompt, render_style_prompt
+from client_pool import ClientPool
+from history import HistoryStore, SessionHistory
+from corpus import final_messages, map_extract, merge_usage, reduce_partials, split_corpus, split_emails
+from perf import ScriptTimer
+from preprocess import DEFAULT_TOKEN_BUDGET, MAX_TOKEN_BUDGET, preprocess_email
+from llm import (
+    SYSTEM_EXTRACT, SYSTEM_GENERATE, Completion, build_messages, chat_completion, error_message, stream_chat_completion
+)
+from metrics import DEFAULT_METRICS_PORT, Metrics, serve_metrics, start_call
+from response_cache import ResponseCache
+from scheduler import Scheduler
+from style_store import StyleStore
+from stylometry import describe, profile_batch, summarize
+from variants import bundle_zip, generate_many, parse_request_table
+
+# set_page_config は最初の Streamlit コマンドでなければならない
+# (cache_resource のスピナーや session_state の初期化より前に呼ぶ)
 st.set_page_config(
     page_title="Email Stylist Pro", 
     page_icon="📧",
@@ -17,24 +34,192 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# --- 初期設定 -----------------------------------------------------------
+@st.cache_resource
+def get_response_cache():
+    # 応答キャッシュはプロセス内で1つだけ開き、全セッションで共有する
+    return ResponseCache()
+
+
+@st.cache_resource
+def get_client_pool():
+    # OpenAI クライアントは API キーごとにプロセス内で使い回し、keep-alive 接続を維持する
+    # 再試行は共有スケジューラがバックオフ付きで行うため、クライアント側では行わない
+    return ClientPool(max_retries=0)
+
+
+@st.cache_resource
+def get_style_store():
+    # スタイルライブラリと類似検索用の索引はプロセス内で共有する
+    return StyleStore()
+
+
+@st.cache_resource
+def get_history_store():
+    # メモリからあふれた生成履歴の保存先 (セッション ID で区別する)
+    return HistoryStore()
+
+
+@st.cache_resource
+def get_script_timer():
+    return ScriptTimer()
+
+
+@st.cache_resource
+def get_scheduler():
+    # レート制限のバケットと待ち行列は全セッションで共有する
+    return Scheduler()
+
+
+@st.cache_resource
+def get_cascade_stats():
+    return CascadeStats()
+
+
+@st.cache_resource
+def get_metrics():
+    # 全セッションの API 呼び出しを集計し、MAIL_GPT_METRICS_PORT があれば /metrics で公開する
+    metrics = Metrics()
+    if DEFAULT_METRICS_PORT:
+        try:
+            serve_metrics(metrics, DEFAULT_METRICS_PORT)
+        except OSError:
+            # 同じポートを別プロセスが使用中 (複数プロセス起動時) は公開しない
+            pass
+    return metrics
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_preprocess(text, token_budget):
+    # 再実行のたびに同じ入力を前処理し直さないよう、(テキスト, 上限) ごとに結果を使い回す
+    return preprocess_email(text, token_budget)
+
+
+response_cache = get_response_cache()
+client_pool = get_client_pool()
+style_store = get_style_store()
+script_timer = get_script_timer()
+metrics = get_metrics()
+scheduler = get_scheduler()
+cascade_stats = get_cascade_stats()
+
+# 待ち行列を利用者ごとに分けるための ID
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 履歴は直近の一定件数だけメモリに持ち、1 ページずつ描画して再実行のコストを一定に保つ
+if "history" not in st.session_state:
+    st.session_state.history = SessionHistory(get_history_store(), st.session_state.session_id)
+HISTORY_PAGE_SIZE = 10
+
+
+def run_completion(client, render, stream, spinner_text, **call):
+    """API を呼び出し、途中経過を render(text, done) で表示して Completion を返す
+
+    stream=True の場合はトークンが届くたびに render を呼ぶ。再実行や停止で
+    スクリプトが中断されたときは上流のストリームを閉じてリクエストを打ち切る。
+    """
+    if not stream:
+        with st.spinner(spinner_text):
+            res = chat_completion(client, **call)
+        render(res.content, True)
+        return res
+
+    chat_stream = stream_chat_completion(client, **call)
+    text = ""
+    render(text, False)
+    try:
+        for delta in chat_stream:
+            text += delta
+            render(text, False)
+    finally:
+        chat_stream.close()
+    render(text, True)
+    return chat_stream.completion
+
+
+# この実行で API を呼んだか (呼んだ実行は再実行時間の計測から除く)
+api_called = False
+
+
+def get_client(queue_slot):
+    """共有スケジューラを経由するクライアントを返す。順番待ちの間は queue_slot に待ち件数を表示する"""
+    global api_called
+    api_called = True
+
+    def show_queue(position):
+        # 並列実行のワーカースレッドからは描画できないため、スクリプトのスレッドでのみ表示する
+        if get_script_run_ctx() is None:
+            return
+        if position is None:
+            queue_slot.empty()
+        else:
+            queue_slot.info(f"⏳ リクエストが混み合っているため順番待ちです（前に {position} 件）")
+    return scheduler.client(client_pool.get(api_key), st.session_state.session_id, on_wait=show_queue)
+
+
+def render_metrics_panel(slot):
+    """サイドバーの計測パネル (ボタン処理の後に呼び、今回の呼び出しも反映する)"""
+    rows = metrics.summary()
+    with slot.container():
+        if not rows:
+            st.caption("まだ API 呼び出しはありません")
+            return
+        st.dataframe(
+            [
+                {
+                    "種別": r["kind"],
+                    "モデル": r["model"],
+                    "回数": r["calls"],
+                    "キャッシュ": r["cached"],
+                    "エラー": r["errors"],
+                    "合計 p50 (ms)": r["total_p50_ms"],
+                    "合計 p95 (ms)": r["total_p95_ms"],
+                    "初回トークン p50 (ms)": r["ttft_p50_ms"],
+                    "平均入力トークン": r["avg_prompt_tokens"],
+                    "平均出力トークン": r["avg_completion_tokens"],
+                    "プロンプトキャッシュ率": r["prompt_cache_ratio"],
+                }
+                for r in rows
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        errors = {}
+        for r in rows:
+            for name, count in r["error_types"].items():
+                errors[name] = errors.get(name, 0) + count
+        if errors:
+            st.caption("エラー内訳: " + "、".join(f"{name} {count} 件" for name, count in errors.items()))
+        sched_stats = scheduler.stats()
+        st.caption(
+            f"🚦 スケジューラ: 待機中 {sched_stats['waiting']} 件 / 再試行 {sched_stats['retries']} 回"
+            f"（うちレート制限 {sched_stats['throttled']} 回）/ 失敗 {sched_stats['failed']} 件"
+        )
+        cascade = cascade_stats.summary()
+        if cascade["tiers"]:
+            tiers = "、".join(
+                f"{name} 合格 {t['passed']}/{t['attempts']}" for name, t in cascade["tiers"].items()
+            )
+            if cascade["mean_saved_ms"] is not None:
+                saved = f"、平均 {cascade['mean_saved_ms']:.0f} ms 短縮"
+            else:
+                # 短縮時間は、段階実行を無効にして上位モデルで抽出した所要時間と比べる
+                saved = "（短縮時間は段階実行なしの抽出を記録すると表示されます）"
+            st.caption(f"🪜 段階実行: {tiers}{saved}")
+        if DEFAULT_METRICS_PORT:
+            st.caption(f"Prometheus: :{DEFAULT_METRICS_PORT}/metrics")
+
+
+def add_history(request, email):
+    st.session_state.history.add(request, email)
+
+
+def preview_html(text):
+    return f"<div style='background-color: white; padding: 20px; border-radius: 5px; border: 1px solid #ccc;'>{text.replace(chr(10), '<br>')}</div>"
+
 # カスタムCSS
-st.markdown("""
-<style>
-    .main-header {color: #000000; font-size: 2.5rem !important; font-weight: 700; margin-bottom: 1rem;}
-    .sub-header {color: #333333; font-size: 1.8rem !important; font-weight: 600; margin-top: 1rem;}
-    .info-text {font-size: 1.1rem; color: #000000;}
-    .highlight {background-color: #f0f0f0; padding: 1rem; border-radius: 0.5rem; margin: 1rem 0;}
-    .success-box {background-color: #f0f0f0; padding: 1rem; border-radius: 0.5rem; border-left: 5px solid #333333;}
-    .info-box {background-color: #f5f5f5; padding: 1rem; border-radius: 0.5rem; border-left: 5px solid #555555;}
-    .btn-custom {background-color: #333333 !important; color: white !important; font-weight: 600 !important;}
-    .footer {font-size: 0.8rem; color: #333333; text-align: center; margin-top: 2rem;}
-    .card {background-color: #f9f9f9; border-radius: 0.5rem; padding: 1.5rem; box-shadow: 0 2px 5px rgba(0,0,0,0.1);}
-    code {font-family: 'Courier New', monospace !important;}
-    pre {background-color: #f5f5f5; padding: 0.5rem; border-radius: 0.3rem;}
-    li {margin-bottom: 0.5rem;}
-    textarea, input {font-family: 'Courier New', monospace !important;}
-</style>
-""", unsafe_allow_html=True)
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # --- サイドバー ---------------------------------------------------------
 with st.sidebar:
@@ -45,157 +230,62 @@ with st.sidebar:
     api_key = st.text_input("🔑 OpenAI API Key", type="password")
     
     # モデル選択
-    models = ["gpt-4.1", "gpt-4o", "gpt-4o-mini", "gpt-3.5-turbo"]
-    model = st.selectbox("🤖 AIモデル", models, index=0)
+    model = st.selectbox("🤖 AIモデル", MODELS, index=0)
     
     # 言語選択
-    languages = ["日本語", "English", "简体中文", "한국어"]
-    language = st.selectbox("🌐 言語", languages, index=0)
+    language = st.selectbox("🌐 言語", LANGUAGES, index=0)
     
     # メールの目的
-    email_purposes = [
-        "一般的な連絡",
-        "お詫び・謝罪",
-        "依頼・お願い", 
-        "お礼・感謝",
-        "案内・招待",
-        "報告・進捗共有",
-        "質問・確認",
-        "スケジュール調整",
-        "お祝い・慶事",
-        "クレーム対応"
-    ]
-    purpose = st.selectbox("📋 メールの目的", email_purposes, index=0)
+    purpose = st.selectbox("📋 メールの目的", EMAIL_PURPOSES, index=0)
     
     # 拡張設定（折りたたみ可能なUIで）
     with st.expander("⚙️ 詳細設定"):
         temperature = st.slider("創造性 (Temperature)", min_value=0.0, max_value=1.0, value=0.7, step=0.1)
         max_tokens = st.slider("最大トークン数", min_value=100, max_value=4000, value=2000, step=100)
+        use_stream = st.toggle("ストリーミング表示", value=True,
+                               help="生成されたトークンを届いた順に表示します")
+        bypass_cache = st.checkbox("キャッシュを使わずに再生成", value=False,
+                                   help="同じ入力でも必ずAPIを呼び出し、キャッシュを更新します")
+        cache_stats = response_cache.stats()
+        st.caption(
+            f"🗄️ キャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']}"
+            f"（全体 {cache_stats['total_hits']} / {cache_stats['total_misses']}、{cache_stats['entries']} 件保存）"
+        )
+        reuse_similar = st.toggle("類似スタイルを再利用", value=True,
+                                  help="ライブラリに似たメールのスタイルがあれば、APIを呼ばずにそのルールを使います")
+        reuse_threshold = st.slider("再利用する類似度", min_value=0.5, max_value=1.0, value=0.9, step=0.01)
+        use_cascade = st.toggle(f"軽量モデル ({CASCADE_MODEL}) で先に抽出", value=False,
+                                help="抽出結果が形式の条件 (8〜12 行・「- 」始まり・原文を転載しない) を満たさない場合だけ、選択中のモデルで再抽出します")
     
     # サンプルメール
     with st.expander("📝 サンプルテンプレート"):
-        sample_emails = {
-            "ビジネスメール (丁寧)": """拝啓
-
-平素より格別のご高配を賜り、厚く御礼申し上げます。
-株式会社〇〇の山田太郎でございます。
-
-先日はご多忙の中、弊社製品についてご検討いただき誠にありがとうございました。
-ご要望いただいた資料を添付させていただきます。
-
-ご不明な点がございましたら、お気軽にお問い合わせください。
-今後とも何卒よろしくお願い申し上げます。
-
-敬具""",
-            "カジュアルな連絡": """こんにちは山田さん
-
-先日はありがとうございました！
-打ち合わせの件ですが、来週の水曜日15時からでよろしいでしょうか？
-
-ご都合を教えてくださいm(_ _)m
-よろしくお願いします！
-
-田中""",
-            "お詫びメール": """件名: 【お詫び】納品遅延について
-
-○○様
-
-いつもお世話になっております。
-株式会社△△の佐藤でございます。
-
-先日ご注文いただきました商品の納期遅延につきまして、
-心よりお詫び申し上げます。
-
-当初の予定では本日お届けの予定でしたが、
-生産ラインの一部トラブルにより3営業日ほど遅れる見込みとなりました。
-
-ご迷惑をおかけし大変申し訳ございません。
-今後このようなことがないよう、生産体制を見直してまいります。
-
-何卒ご理解いただきますようお願い申し上げます。
-
-株式会社△△
-佐藤一郎
-TEL: 03-XXXX-XXXX""",
-            "お礼メール": """鈴木様
-
-先日はお忙しい中、当社イベントにご参加いただき誠にありがとうございました。
-おかげさまで、大盛況のうちに終えることができました。
-
-ご提供いただいたフィードバックは、今後の企画に活かしてまいります。
-引き続きご支援いただけますと幸いです。
-
-今後ともどうぞよろしくお願いいたします。
-
-佐々木""",
-            "社内連絡 (報告)": """部長
-
-先週依頼いただいた四半期レポートの進捗状況をご報告いたします。
-
-【完了項目】
-・売上データの集計
-・前年同期との比較分析
-・部門別実績まとめ
-
-【作業中】
-・グラフ作成と考察（70%完了）
-・来期予測（30%完了）
-
-すべて予定通り進んでおり、週末までには完成版をお送りできる見込みです。
-何かご質問やご指示がありましたら、お知らせください。
-
-伊藤""",
-            "スケジュール調整": """チームのみなさん
-
-来週のプロジェクトミーティングの日程調整をしたいと思います。
-下記の候補日時から都合の良い時間をお知らせください。
-
-①月曜日 10:00-11:30
-②火曜日 13:00-14:30
-③水曜日 15:00-16:30
-
-アジェンダは以下の通りです。
-1. 現在の進捗確認（15分）
-2. 課題の洗い出しと解決策検討（30分）
-3. 次のマイルストーン設定（15分）
-4. 質疑応答（15分）
-
-参加できない場合は事前にコメントをいただけると助かります。
-よろしくお願いします。
-
-プロジェクトリーダー 小林""",
-            "案内・招待": """山本様
-
-来る6月15日(土)に当社創立10周年記念パーティーを開催することとなりました。
-日頃お世話になっている山本様にもぜひご出席いただきたく、ご案内申し上げます。
-
-【日時】6月15日(土) 18:00-20:30
-【場所】グランドホテル東京 2階「桜の間」
-【内容】軽食ビュッフェ、記念スピーチ、アトラクション等
-
-ご多忙中誠に恐縮ですが、6月5日(水)までにご出欠のご連絡をいただけますと幸いです。
-お会いできることを心よりお待ちしております。
-
-株式会社○○
-イベント担当 高橋
-TEL: 03-XXXX-XXXX
-Email: event@xxxx.co.jp"""
-        }
-        
-        selected_sample = st.selectbox("サンプル選択", list(sample_emails.keys()))
+        selected_sample = st.selectbox("サンプル選択", list(SAMPLE_EMAILS.keys()))
         if st.button("サンプルを適用"):
-            st.session_state.email_input = sample_emails[selected_sample]
+            st.session_state.email_input = SAMPLE_EMAILS[selected_sample]
             
     # 保存済みスタイル
     with st.expander("💾 保存済みスタイル"):
-        if "saved_styles" not in st.session_state:
-            st.session_state.saved_styles = {}
-            
-        if st.session_state.saved_styles:
-            selected_style = st.selectbox("保存済みスタイル", list(st.session_state.saved_styles.keys()))
-            if st.button("ロード"):
-                st.session_state.style_rules = st.session_state.saved_styles[selected_style]
-                st.success(f"スタイル '{selected_style}' を読み込みました")
+        style_query = st.text_input("🔎 名前で検索", key="style_query")
+        named_styles = style_store.list_named(style_query)
+        if named_styles:
+            selected_style = st.selectbox(
+                "保存済みスタイル",
+                named_styles,
+                format_func=lambda s: f"{s['name']} ({datetime.datetime.fromtimestamp(s['updated_at']).strftime('%Y-%m-%d')})"
+            )
+            load_col, delete_col = st.columns(2)
+            if load_col.button("ロード", use_container_width=True):
+                st.session_state.style_rules = style_store.get(selected_style["id"])["rules"]
+                st.session_state.style_id = selected_style["id"]
+                st.success(f"スタイル '{selected_style['name']}' を読み込みました")
+            if delete_col.button("削除", use_container_width=True):
+                style_store.delete(selected_style["id"])
+                st.rerun()
+        st.caption(f"ライブラリ: {len(style_store)} 件")
+    
+    # API 呼び出しの計測 (スクリプトの最後に描画する)
+    with st.expander("📈 メトリクス"):
+        metrics_slot = st.empty()
 
 # タブを作成
 tab1, tab2 = st.tabs(["📝 スタイル抽出", "✉️ メール生成"])
@@ -219,10 +309,37 @@ with tab1:
             key="email_src"
         )
         
+        # コーパスモード（複数メール・長文の分割分析）
+        with st.expander("📚 コーパスモード（複数メール・長文）"):
+            corpus_mode = st.checkbox(
+                "メールを分割して並列に分析する",
+                value=False,
+                help="区切り線 (---) ごと、または指定トークン数ごとに分割して部分ルールを並列に抽出し、最後に統合します"
+            )
+            chunk_tokens = st.slider("チャンクあたりの最大トークン数", min_value=500, max_value=8000, value=3000, step=500)
+            fan_out = st.slider("並列リクエスト数", min_value=1, max_value=16, value=4)
+        
+        # 引用・重複署名・定型フッター・重複メールを取り除き、トークン数を上限内に収める
+        with st.expander("🧹 前処理（引用・署名・重複の除去）"):
+            use_preprocess = st.checkbox("前処理したテキストを分析に使う", value=True)
+            # コーパスモードは全体をチャンクに分けて分析するため、入力全体の上限は適用しない
+            token_budget = st.slider("入力の最大トークン数", min_value=1000, max_value=MAX_TOKEN_BUDGET,
+                                     value=DEFAULT_TOKEN_BUDGET, step=1000, disabled=corpus_mode,
+                                     help="コーパスモードでは適用されません")
+        analysis_src = email_src
+        if email_src and use_preprocess:
+            prep = cached_preprocess(email_src, None if corpus_mode else token_budget)
+            analysis_src = prep.text
+            st.caption(
+                f"🧹 前処理: {prep.tokens_before:,} → {prep.tokens_after:,} トークン"
+                f"（{prep.messages} 通、引用・返信履歴 {prep.quoted_lines} 行・重複メール {prep.duplicates} 通・"
+                f"重複署名 {prep.signatures} 件を除去{'、上限で切り詰め' if prep.truncated else ''}）"
+            )
+        
         # 分析ボタンの作成（カスタムスタイル適用）
         extract_btn = st.button(
             "🔍 スタイルを分析", 
-            disabled=not (email_src and api_key),
+            disabled=not (analysis_src and api_key),
             type="primary",
             use_container_width=True
         )
@@ -247,6 +364,15 @@ with tab1:
         - 使用される慣用表現
         """)
         st.markdown('</div>', unsafe_allow_html=True)
+        
+        # API を呼ばずに計算できる特徴量は入力と同時に表示する
+        if analysis_src:
+            local_emails = split_emails(analysis_src)
+            st.markdown('<div class="card" style="margin-top: 1rem;">', unsafe_allow_html=True)
+            st.markdown("### 📐 ローカル分析（API不要）")
+            st.markdown("\n".join(f"- {line}" for line in describe(summarize(profile_batch(local_emails)))))
+            st.caption(f"{len(local_emails)} 通のメールから算出")
+            st.markdown('</div>', unsafe_allow_html=True)
     
     # スタイルルール初期化
     if "style_rules" not in st.session_state:
@@ -254,39 +380,102 @@ with tab1:
     
     # 分析ボタンが押された場合の処理
     if extract_btn:
-        with st.spinner("文体を分析中..."):
-            tpl = env.get_template("style_rules_prompt.jinja2")
-            prompt = tpl.render(email_text=email_src)
-            try:
-                client = OpenAI(api_key=api_key)
-                res = client.chat.completions.create(
-                    model=model,
-                    temperature=0.3,
-                    messages=[
-                        {"role": "system", "content": "You are an expert writing-style analyst."},
-                        {"role": "user", "content": prompt},
-                    ],
-                )
-                style_rules = res.choices[0].message.content
-                st.session_state.style_rules = style_rules
+        try:
+            # 分析結果の表示
+            st.markdown('<div class="success-box">', unsafe_allow_html=True)
+            st.markdown('<h2 class="sub-header">📝 抽出された文体ルール</h2>', unsafe_allow_html=True)
+            
+            # ライブラリに十分似たスタイルがあれば API を呼ばずに再利用する
+            match = style_store.find_similar(analysis_src, min_score=reuse_threshold) if reuse_similar and not bypass_cache else None
+            if match is not None:
+                style, score = match
+                st.markdown(style["rules"])
+                label = f"「{style['name']}」" if style["name"] else ""
+                st.caption(f"♻️ ライブラリの類似スタイル{label}を再利用しました（類似度 {score:.2f}）")
+                st.session_state.style_rules = style["rules"]
+                st.session_state.style_id = style["id"]
+            else:
+                queue_slot = st.empty()
+                client = get_client(queue_slot)
                 
-                # 分析結果の表示
-                st.markdown('<div class="success-box">', unsafe_allow_html=True)
-                st.markdown('<h2 class="sub-header">📝 抽出された文体ルール</h2>', unsafe_allow_html=True)
-                st.markdown(style_rules)
+                # コーパスモード: チャンクごとの部分ルールを並列に抽出し、最終統合のみ下で実行する
+                partial_results = []
+                chunks = split_corpus(analysis_src, chunk_tokens) if corpus_mode else []
+                # 最終の抽出 (統合) は段階実行の対象にする
+                tiers = cascade_tiers(model) if use_cascade else [model]
+                if len(chunks) <= 1:
+                    record = start_call(metrics, "extract", tiers[0])
+                    with record.stage("render"):
+                        messages = build_messages(SYSTEM_EXTRACT, render_style_prompt(analysis_src))
+                else:
+                    progress = st.progress(0.0, text=f"{len(chunks)} チャンクを並列に分析中...")
+                    
+                    def show_progress(done, total):
+                        progress.progress(done / total, text=f"部分ルールを抽出中... {done}/{total}")
+                    
+                    call = dict(max_workers=fan_out, cache=response_cache, bypass_cache=bypass_cache,
+                                metrics=metrics, temperature=0.3)
+                    partial_results = map_extract(client, model, chunks, on_progress=show_progress, **call)
+                    partials, intermediate = reduce_partials(
+                        client, model, [r.content for r in partial_results], on_progress=show_progress, **call
+                    )
+                    partial_results += intermediate
+                    progress.empty()
+                    record = start_call(metrics, "extract_merge", tiers[0])
+                    with record.stage("render"):
+                        messages = final_messages(partials)
+                    st.caption(f"📚 {len(chunks)} チャンクから抽出した部分ルールを統合しました")
                 
-                # スタイル保存機能
-                save_name = st.text_input("このスタイルに名前をつけて保存", placeholder="例: ビジネス丁寧スタイル")
-                if st.button("保存", key="save_style"):
-                    if save_name:
-                        if "saved_styles" not in st.session_state:
-                            st.session_state.saved_styles = {}
-                        st.session_state.saved_styles[save_name] = style_rules
-                        st.success(f"'{save_name}'として保存しました！")
+                rules_area = st.empty()
                 
-                st.markdown('</div>', unsafe_allow_html=True)
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
+                def render_rules(text, done):
+                    rules_area.markdown(text if done else text + "▌")
+                
+                def attempt(tier_model):
+                    return run_completion(
+                        client,
+                        render_rules,
+                        use_stream,
+                        f"文体を分析中 ({tier_model})...",
+                        model=tier_model,
+                        messages=messages,
+                        cache=response_cache,
+                        bypass_cache=bypass_cache,
+                        record=record if tier_model == tiers[0] else start_call(metrics, record.kind, tier_model),
+                        temperature=0.3,
+                    )
+                
+                res, used_model, history = run_cascade(
+                    tiers, attempt, lambda text: validate_rules(text, analysis_src), cascade_stats
+                )
+                if len(history) > 1:
+                    st.caption(
+                        f"🪜 {history[0][0]} の結果が条件を満たさなかったため {used_model} で再抽出しました"
+                        f"（{'、'.join(history[0][1])}）"
+                    )
+                elif len(tiers) > 1:
+                    st.caption(f"🪜 {used_model} の結果が条件を満たしたため、上位モデルを使わずに完了しました")
+                if use_cascade and history[-1][1]:
+                    st.warning("抽出結果が形式の条件を満たしていません: " + "、".join(history[-1][1]))
+                if partial_results:
+                    res = Completion(res.content, merge_usage(partial_results + [res]), cached=res.cached)
+                st.session_state.style_rules = res.content
+                # 抽出結果はライブラリに記録し、次回以降の類似検索の対象にする
+                st.session_state.style_id = style_store.add(res.content, analysis_src, model=used_model)
+                if res.cached:
+                    st.caption("♻️ キャッシュ済みの分析結果を表示しています")
+            
+            st.markdown('</div>', unsafe_allow_html=True)
+        except Exception as e:
+            st.error(error_message(e))
+    
+    # スタイル保存機能
+    if st.session_state.style_rules and st.session_state.get("style_id"):
+        save_name = st.text_input("このスタイルに名前をつけて保存", placeholder="例: ビジネス丁寧スタイル")
+        if st.button("保存", key="save_style"):
+            if save_name:
+                style_store.set_name(st.session_state.style_id, save_name)
+                st.success(f"'{save_name}'として保存しました！")
 
 # --- 2) メール生成タブ --------------------------------------------------
 with tab2:
@@ -310,12 +499,26 @@ with tab2:
                 recipient = st.text_input("宛先 (任意)", placeholder="例: 田中様")
                 formality = st.slider("フォーマリティ", 1, 5, 3, 
                                help="1=カジュアル、5=非常に丁寧")
-                length = st.radio("メールの長さ", ["短め", "標準", "詳細"], index=1)
+                length = st.radio("メールの長さ", LENGTHS, index=1)
+            
+            # 生成モード（1通 / 同じ依頼の複数案 / 依頼リストの一括生成）
+            gen_mode = st.radio("🧪 生成モード", ["1通", "バリエーション", "複数の依頼"], horizontal=True)
+            request_table = ""
+            if gen_mode == "バリエーション":
+                n_variants = st.slider("バリエーション数", min_value=2, max_value=5, value=3,
+                                       help="1回のリクエストで複数の案を生成します")
+            elif gen_mode == "複数の依頼":
+                request_table = st.text_area(
+                    "📑 依頼リスト（1行1件、「宛先<タブまたはカンマ>依頼内容」）",
+                    placeholder="田中様\t会議の日程変更のお知らせ\n佐藤様\t資料送付のお礼",
+                    height=150
+                )
+                batch_concurrency = st.slider("同時リクエスト数", min_value=1, max_value=16, value=4)
             
             # 生成ボタン
             gen_btn = st.button(
                 "✨ メールを生成", 
-                disabled=not (user_request and api_key),
+                disabled=not ((request_table if gen_mode == "複数の依頼" else user_request) and api_key),
                 type="primary",
                 use_container_width=True
             )
@@ -335,88 +538,235 @@ with tab2:
                 )
             st.markdown('</div>', unsafe_allow_html=True)
         
-        if gen_btn:
-            with st.spinner("メールを生成中..."):
-                tpl = env.get_template("email_generate_prompt.jinja2")
+        if gen_btn and gen_mode == "1通":
+            # 追加オプションを含めたプロンプト作成
+            record = start_call(metrics, "generate", model)
+            with record.stage("render"):
+                gen_prompt = render_generate_prompt(
+                    st.session_state.style_rules,
+                    user_request,
+                    recipient=recipient,
+                    formality=formality,
+                    length=length,
+                    purpose=purpose
+                )
+            
+            try:
+                queue_slot = st.empty()
+                client = get_client(queue_slot)
                 
-                # 追加オプションを含めたプロンプト作成
-                additional_info = {
-                    "recipient": recipient if 'recipient' in locals() and recipient else "",
-                    "formality": formality if 'formality' in locals() else 3,
-                    "length": length if 'length' in locals() else "標準",
-                    "purpose": purpose
-                }
+                # 生成されたメールの表示
+                st.markdown('<div class="success-box">', unsafe_allow_html=True)
+                st.markdown('<h2 class="sub-header">📨 生成されたメール</h2>', unsafe_allow_html=True)
+                
+                # タブでプレーンテキストとプレビュー表示を切り替え
+                email_tab1, email_tab2 = st.tabs(["✉️ テキスト", "👁️ プレビュー"])
+                with email_tab1:
+                    text_slot = st.empty()
+                    actions_slot = st.container()
+                with email_tab2:
+                    preview_slot = st.empty()
                 
-                gen_prompt = tpl.render(
-                    style_rules=st.session_state.style_rules, 
-                    user_request=user_request,
-                    additional_info=additional_info
+                def render_email(text, done):
+                    # 生成中はテキストとして逐次表示し、完了後に編集可能なテキストエリアへ置き換える
+                    if done:
+                        text_slot.text_area("", text, height=300)
+                    else:
+                        text_slot.text(text + "▌")
+                    preview_slot.markdown(preview_html(text), unsafe_allow_html=True)
+                
+                res = run_completion(
+                    client,
+                    render_email,
+                    use_stream,
+                    "メールを生成中...",
+                    model=model,
+                    messages=build_messages(SYSTEM_GENERATE, gen_prompt),
+                    cache=response_cache,
+                    bypass_cache=bypass_cache,
+                    record=record,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
                 )
+                email_out = res.content
+                if res.cached:
+                    st.caption("♻️ キャッシュ済みの生成結果を表示しています")
+                
+                with actions_slot:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.download_button(
+                            "📥 ダウンロード (.txt)", 
+                            email_out, 
+                            file_name=f"email_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                            use_container_width=True
+                        )
+                    with col2:
+                        st.button(
+                            "📋 クリップボードにコピー", 
+                            key="copy_btn",
+                            use_container_width=True,
+                            on_click=lambda: st.write('<script>navigator.clipboard.writeText(`' + email_out.replace('`', '\\`') + '`);</script>', unsafe_allow_html=True)
+                        )
+                
+                # 改善提案
+                with st.expander("💡 メール改善のヒント"):
+                    st.markdown("""
+                    - **主題を明確に:** 最初の段落で目的を明確にしましょう
+                    - **簡潔さを心がける:** 不要な説明は省きましょう
+                    - **アクションアイテムを明確に:** 相手に何を求めるか明確にしましょう
+                    - **締めくくりを丁寧に:** 最後の挨拶は印象を左右します
+                    """)
                 
+                st.markdown('</div>', unsafe_allow_html=True)
+                
+                # 履歴に保存
+                add_history(user_request, email_out)
+                
+            except Exception as e:
+                st.error(error_message(e))
+        
+        elif gen_btn and gen_mode == "バリエーション":
+            record = start_call(metrics, "generate_variants", model)
+            with record.stage("render"):
+                gen_prompt = render_generate_prompt(
+                    st.session_state.style_rules,
+                    user_request,
+                    recipient=recipient,
+                    formality=formality,
+                    length=length,
+                    purpose=purpose
+                )
+            
+            try:
+                queue_slot = st.empty()
+                client = get_client(queue_slot)
+                
+                st.markdown('<div class="success-box">', unsafe_allow_html=True)
+                st.markdown('<h2 class="sub-header">📨 生成されたバリエーション</h2>', unsafe_allow_html=True)
+                
+                # 各案を横並びで表示する
+                variant_slots = []
+                for i, column in enumerate(st.columns(n_variants)):
+                    with column:
+                        st.markdown(f"**案 {i + 1}**")
+                        variant_slots.append(st.empty())
+                
+                # n 件の候補を 1 回のリクエストで生成する
+                call = dict(
+                    model=model,
+                    messages=build_messages(SYSTEM_GENERATE, gen_prompt),
+                    cache=response_cache,
+                    bypass_cache=bypass_cache,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    n=n_variants,
+                    record=record,
+                )
+                if use_stream:
+                    chat_stream = stream_chat_completion(client, **call)
+                    texts = [""] * n_variants
+                    try:
+                        for index, delta in chat_stream.iter_choices():
+                            texts[index] += delta
+                            variant_slots[index].text(texts[index] + "▌")
+                    finally:
+                        chat_stream.close()
+                    res = chat_stream.completion
+                else:
+                    with st.spinner("バリエーションを生成中..."):
+                        res = chat_completion(client, **call)
+                
+                for i, (slot, text) in enumerate(zip(variant_slots, res.choices)):
+                    slot.text_area(f"案 {i + 1}", text, height=300, label_visibility="collapsed")
+                
+                stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                st.download_button(
+                    "📥 まとめてダウンロード (.zip)",
+                    bundle_zip([(f"email_{stamp}_{i + 1}.txt", text) for i, text in enumerate(res.choices)]),
+                    file_name=f"emails_{stamp}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
+                st.markdown('</div>', unsafe_allow_html=True)
+                
+                for text in res.choices:
+                    add_history(user_request, text)
+                
+            except Exception as e:
+                st.error(error_message(e))
+        
+        elif gen_btn:
+            rows = parse_request_table(request_table)
+            if not rows:
+                st.warning("依頼リストを読み取れませんでした。1行に1件ずつ入力してください。")
+            else:
                 try:
-                    client = OpenAI(api_key=api_key)
-                    res = client.chat.completions.create(
-                        model=model,
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant that writes emails."},
-                            {"role": "user", "content": gen_prompt},
-                        ],
-                    )
-                    email_out = res.choices[0].message.content
+                    queue_slot = st.empty()
+                    client = get_client(queue_slot)
                     
-                    # 生成されたメールの表示
                     st.markdown('<div class="success-box">', unsafe_allow_html=True)
-                    st.markdown('<h2 class="sub-header">📨 生成されたメール</h2>', unsafe_allow_html=True)
-                    
-                    # タブでプレーンテキストとプレビュー表示を切り替え
-                    email_tab1, email_tab2 = st.tabs(["✉️ テキスト", "👁️ プレビュー"])
+                    st.markdown(f'<h2 class="sub-header">📨 生成されたメール（{len(rows)} 件）</h2>', unsafe_allow_html=True)
+                    progress = st.progress(0.0, text=f"0/{len(rows)} 件完了")
                     
-                    with email_tab1:
-                        st.text_area("", email_out, height=300)
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.download_button(
-                                "📥 ダウンロード (.txt)", 
-                                email_out, 
-                                file_name=f"email_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                                use_container_width=True
-                            )
-                        with col2:
-                            st.button(
-                                "📋 クリップボードにコピー", 
-                                key="copy_btn",
-                                use_container_width=True,
-                                on_click=lambda: st.write('<script>navigator.clipboard.writeText(`' + email_out.replace('`', '\\`') + '`);</script>', unsafe_allow_html=True)
-                            )
+                    # 3 列のグリッドに枠を用意し、完了したものから埋めていく
+                    batch_slots = []
+                    for start in range(0, len(rows), 3):
+                        for column, row in zip(st.columns(3), rows[start:start + 3]):
+                            with column:
+                                st.markdown(f"**{row['recipient'] or recipient or '（宛先なし）'}**: {row['request'][:40]}")
+                                slot = st.empty()
+                                slot.caption("⏳ 生成待ち")
+                                batch_slots.append(slot)
                     
-                    with email_tab2:
-                        st.markdown(f"<div style='background-color: white; padding: 20px; border-radius: 5px; border: 1px solid #ccc;'>{email_out.replace(chr(10), '<br>')}</div>", unsafe_allow_html=True)
-                    
-                    # 改善提案
-                    with st.expander("💡 メール改善のヒント"):
-                        st.markdown("""
-                        - **主題を明確に:** 最初の段落で目的を明確にしましょう
-                        - **簡潔さを心がける:** 不要な説明は省きましょう
-                        - **アクションアイテムを明確に:** 相手に何を求めるか明確にしましょう
-                        - **締めくくりを丁寧に:** 最後の挨拶は印象を左右します
-                        """)
+                    message_list = [
+                        build_messages(SYSTEM_GENERATE, render_generate_prompt(
+                            st.session_state.style_rules,
+                            row["request"],
+                            recipient=row["recipient"] or recipient,
+                            formality=formality,
+                            length=length,
+                            purpose=purpose
+                        ))
+                        for row in rows
+                    ]
+                    results = [None] * len(rows)
+                    completed = generate_many(
+                        client,
+                        model,
+                        message_list,
+                        concurrency=batch_concurrency,
+                        cache=response_cache,
+                        bypass_cache=bypass_cache,
+                        metrics=metrics,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                    for done, (i, result) in enumerate(completed, start=1):
+                        results[i] = result
+                        if isinstance(result, Exception):
+                            batch_slots[i].error(error_message(result))
+                        else:
+                            batch_slots[i].text_area(f"#{i + 1}", result.content, height=250, label_visibility="collapsed")
+                        progress.progress(done / len(rows), text=f"{done}/{len(rows)} 件完了")
                     
+                    succeeded = [(i, r) for i, r in enumerate(results) if not isinstance(r, Exception)]
+                    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                    st.download_button(
+                        "📥 まとめてダウンロード (.zip)",
+                        bundle_zip([(f"email_{stamp}_{i + 1:03d}.txt", r.content) for i, r in succeeded]),
+                        file_name=f"emails_{stamp}.zip",
+                        mime="application/zip",
+                        disabled=not succeeded,
+                        use_container_width=True
+                    )
                     st.markdown('</div>', unsafe_allow_html=True)
                     
-                    # 履歴に保存
-                    if "email_history" not in st.session_state:
-                        st.session_state.email_history = []
-                    
-                    st.session_state.email_history.append({
-                        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "request": user_request,
-                        "email": email_out
-                    })
+                    for i, r in succeeded:
+                        add_history(rows[i]["request"], r.content)
                     
                 except Exception as e:
-                    st.error(f"エラーが発生しました: {e}")
+                    st.error(error_message(e))
     else:
         st.markdown('<div class="info-box">', unsafe_allow_html=True)
         st.markdown("### 💡 まずはスタイルを抽出してください")
@@ -424,17 +774,42 @@ with tab2:
         st.markdown('</div>', unsafe_allow_html=True)
 
 # --- 履歴タブ (オプション) ----------------------------------------------
-if "email_history" in st.session_state and st.session_state.email_history:
-    with st.expander("📚 履歴"):
-        for i, item in enumerate(reversed(st.session_state.email_history)):
-            st.markdown(f"**{item['timestamp']}**")
-            st.markdown(f"要件: {item['request'][:50]}...")
-            if st.button(f"表示する #{i+1}", key=f"show_history_{i}"):
-                st.text_area(f"生成履歴 #{i+1}", item['email'], height=200)
+if len(st.session_state.history):
+    with st.expander(f"📚 履歴（{len(st.session_state.history)} 件）"):
+        history_query = st.text_input("🔎 依頼内容で検索", key="history_query")
+        history_page = st.session_state.get("history_page", 1) - 1
+        entries, total = st.session_state.history.page(history_page, HISTORY_PAGE_SIZE, history_query)
+        pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+        if history_page >= pages:
+            # 検索で件数が減った場合は先頭ページに戻す
+            history_page = 0
+            st.session_state.history_page = 1
+            entries, total = st.session_state.history.page(0, HISTORY_PAGE_SIZE, history_query)
+        if not entries:
+            st.caption("一致する履歴はありません")
+        for i, item in enumerate(entries, start=history_page * HISTORY_PAGE_SIZE + 1):
+            st.markdown(f"**{item.timestamp}**")
+            st.markdown(f"要件: {item.request[:50]}...")
+            # 本文は「表示する」を押したエントリーだけ展開する
+            if st.button(f"表示する #{i}", key=f"show_history_{i}"):
+                st.text_area(f"生成履歴 #{i}", item.email, height=200)
             st.divider()
+        if pages > 1:
+            st.number_input(f"ページ（全 {pages} ページ）", min_value=1, max_value=pages, key="history_page")
 
 # --- フッター -----------------------------------------------------------
 st.markdown('<div class="footer">', unsafe_allow_html=True)
 st.markdown("---")
 st.markdown("📧 Email Stylist Pro - API キーはブラウザにのみ保持され、サーバー側には保存されません。")
-st.markdown('</div>', unsafe_allow_html=True)
\ No newline at end of file
+st.markdown('</div>', unsafe_allow_html=True)
+
+# --- 実行時間の計測 -----------------------------------------------------
+render_metrics_panel(metrics_slot)
+script_timer.record((time.perf_counter() - _script_started) * 1000, api_called)
+timer_stats = script_timer.stats()
+if timer_stats["reruns"]:
+    st.caption(
+        f"⏱️ スクリプト実行: 起動時 {timer_stats['cold_start_ms']:.0f} ms / "
+        f"再実行 p50 {timer_stats['rerun_p50_ms']:.1f} ms・p95 {timer_stats['rerun_p95_ms']:.1f} ms"
+        + (f"（API を呼んだ {timer_stats['api_runs']} 回を除く）" if timer_stats["api_runs"] else "")
+    )
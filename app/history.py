@@ -0,0 +1,111 @@
+"""生成履歴: メモリ上のリングバッファと、あふれた分を保存する SQLite
+
+セッションごとに直近 memory_limit 件だけを圧縮した形でメモリに持ち、古いものからディスクへ移す。
+一覧はページ単位で取得するため、履歴の件数が増えても 1 回の再実行で扱う件数は一定になる。
+"""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass
+
+DEFAULT_HISTORY_DB_PATH = os.environ.get(
+    "MAIL_GPT_HISTORY_DB_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "mail_gpt_gen", "history.sqlite3"),
+)
+DEFAULT_MEMORY_LIMIT = int(os.environ.get("MAIL_GPT_HISTORY_MEMORY", "50"))
+DEFAULT_MAX_AGE = float(os.environ.get("MAIL_GPT_HISTORY_MAX_AGE", str(7 * 24 * 3600)))
+
+
+@dataclass
+class HistoryEntry:
+    ts: float
+    request: str
+    email_z: bytes  # zlib 圧縮した本文
+
+    @property
+    def email(self):
+        return zlib.decompress(self.email_z).decode("utf-8")
+
+    @property
+    def timestamp(self):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.ts))
+
+
+class HistoryStore:
+    """メモリからあふれた履歴を保存する、プロセス内で共有の SQLite (古いものは max_age 秒で削除)"""
+
+    def __init__(self, path=DEFAULT_HISTORY_DB_PATH, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                ts REAL NOT NULL,
+                request TEXT NOT NULL,
+                email BLOB NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_session ON history(session_id, id)")
+        self._conn.execute("DELETE FROM history WHERE ts < ?", (time.time() - max_age,))
+
+    def spill(self, session_id, entries):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO history (session_id, ts, request, email) VALUES (?, ?, ?, ?)",
+                [(session_id, e.ts, e.request, e.email_z) for e in entries],
+            )
+
+    # query は部分一致 (大文字・小文字を区別し、% や _ も普通の文字として扱う)。メモリ上の履歴の `in` と揃える
+    def count(self, session_id, query=""):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM history WHERE session_id = ? AND instr(request, ?) > 0", (session_id, query)
+            ).fetchone()[0]
+
+    def page(self, session_id, query="", offset=0, limit=10):
+        """新しい順に offset 件目から limit 件を返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, request, email FROM history WHERE session_id = ? AND instr(request, ?) > 0 "
+                "ORDER BY id DESC LIMIT ? OFFSET ?",
+                (session_id, query, limit, offset),
+            ).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+
+class SessionHistory:
+    """1 セッション分の履歴。直近 memory_limit 件をメモリに持ち、それより古いものは store に移す"""
+
+    def __init__(self, store, session_id, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.store = store
+        self.session_id = session_id
+        self._recent = deque(maxlen=max(1, memory_limit))
+        self._spilled = 0
+
+    def add(self, request, email):
+        if len(self._recent) == self._recent.maxlen:
+            self.store.spill(self.session_id, [self._recent[0]])
+            self._spilled += 1
+        self._recent.append(HistoryEntry(time.time(), request, zlib.compress(email.encode("utf-8"))))
+
+    def __len__(self):
+        return len(self._recent) + self._spilled
+
+    def page(self, page, page_size=10, query=""):
+        """新しい順に page 番目 (0 始まり) のエントリーと、検索に一致した総件数を返す"""
+        recent = [e for e in reversed(self._recent) if query in e.request]
+        total = len(recent) + (self.store.count(self.session_id, query) if self._spilled else 0)
+        start = page * page_size
+        entries = recent[start:start + page_size]
+        if len(entries) < page_size and self._spilled:
+            offset = max(0, start - len(recent))
+            entries += self.store.page(self.session_id, query, offset, page_size - len(entries))
+        return entries, total
@@ -0,0 +1,299 @@
+"""OpenAI Chat Completions 呼び出しの共通処理
+
+各関数の record に metrics.CallRecord を渡すと、network / ttft の時間・usage・結果を記録して
+呼び出しの終了時に finish() する。
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from response_cache import make_key
+
+SYSTEM_EXTRACT = "You are an expert writing-style analyst."
+SYSTEM_GENERATE = "You are a helpful assistant that writes emails."
+
+
+@dataclass
+class Completion:
+    content: str
+    usage: dict = field(default_factory=dict)
+    cached: bool = False
+    # n > 1 で複数の候補を生成した場合の全候補 (content は先頭の候補)
+    choices: list = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.choices:
+            self.choices = [self.content]
+
+
+def build_messages(system, prompt):
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return {}
+    result = {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+    # プロバイダー側のプロンプトキャッシュに一致した入力トークン数 (対応していない API では省略)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is not None:
+        result["cached_tokens"] = cached
+    return result
+
+
+# 例外クラス名 (openai を import せずに判定する) -> 利用者向けの説明
+ERROR_MESSAGES = {
+    "RateLimitError": "API の利用上限 (レート制限) に達しました。しばらく待ってから再実行してください。",
+    "AuthenticationError": "API キーが無効です。キーを確認してください。",
+    "PermissionDeniedError": "この API キーでは選択したモデルを利用できません。",
+    "NotFoundError": "選択したモデルが見つかりません。",
+    "BadRequestError": "リクエストが受け付けられませんでした (入力が長すぎる可能性があります)。",
+    "APITimeoutError": "API の応答がタイムアウトしました。",
+    "APIConnectionError": "API に接続できませんでした。ネットワークを確認してください。",
+    "InternalServerError": "API 側でエラーが発生しました。時間をおいて再実行してください。",
+}
+
+
+def error_message(e):
+    """例外を UI 表示用のメッセージに変換する"""
+    name = type(e).__name__
+    return f"{ERROR_MESSAGES.get(name, 'エラーが発生しました。')} ({name}: {e})"
+
+
+def _finish(record, outcome, completion=None):
+    if record is not None:
+        record.finish(outcome, completion.usage if completion is not None else None)
+
+
+def _cache_lookup(cache, bypass_cache, model, messages, params):
+    """(キャッシュキー, ヒットした Completion または None) を返す"""
+    if cache is None:
+        return None, None
+    key = make_key(model, messages, **params)
+    hit = None if bypass_cache else cache.get(key)
+    if hit is None:
+        return key, None
+    return key, Completion(hit["content"], hit.get("usage", {}), cached=True, choices=hit.get("choices", []))
+
+
+def _cache_store(cache, key, completion):
+    if key is not None:
+        cache.put(key, {"content": completion.content, "usage": completion.usage, "choices": completion.choices})
+
+
+async def _acache_lookup(cache, bypass_cache, model, messages, params):
+    if cache is None:
+        return None, None
+    return await asyncio.to_thread(_cache_lookup, cache, bypass_cache, model, messages, params)
+
+
+async def _acache_store(cache, key, completion):
+    if cache is not None:
+        await asyncio.to_thread(_cache_store, cache, key, completion)
+
+
+def _from_response(res):
+    choices = [choice.message.content for choice in sorted(res.choices, key=lambda c: c.index)]
+    return Completion(choices[0], _usage_dict(res.usage), choices=choices)
+
+
+def chat_completion(client, model, messages, cache=None, bypass_cache=False, record=None, **params):
+    """Chat Completions を呼び出す。cache があれば同一リクエストの応答を再利用する
+
+    bypass_cache=True の場合はキャッシュを読まずに API を呼び、結果でキャッシュを更新する。
+    """
+    key, hit = _cache_lookup(cache, bypass_cache, model, messages, params)
+    if hit is not None:
+        _finish(record, "cached", hit)
+        return hit
+
+    started = time.perf_counter()
+    try:
+        res = client.chat.completions.create(model=model, messages=messages, **params)
+    except Exception as e:
+        _finish(record, type(e).__name__)
+        raise
+    if record is not None:
+        record.mark("network", started)
+    completion = _from_response(res)
+    _cache_store(cache, key, completion)
+    _finish(record, "ok", completion)
+    return completion
+
+
+async def achat_completion(client, model, messages, cache=None, bypass_cache=False, record=None, **params):
+    """chat_completion の非同期版 (client は AsyncOpenAI)
+
+    応答キャッシュ (SQLite) の読み書きはイベントループを止めないよう別スレッドで行う。
+    """
+    key, hit = await _acache_lookup(cache, bypass_cache, model, messages, params)
+    if hit is not None:
+        _finish(record, "cached", hit)
+        return hit
+
+    started = time.perf_counter()
+    try:
+        res = await client.chat.completions.create(model=model, messages=messages, **params)
+    except Exception as e:
+        _finish(record, type(e).__name__)
+        raise
+    if record is not None:
+        record.mark("network", started)
+    completion = _from_response(res)
+    await _acache_store(cache, key, completion)
+    _finish(record, "ok", completion)
+    return completion
+
+
+class ChatStream:
+    """ストリーミング応答をテキスト断片として順に返すイテレータ
+
+    最後まで読み切ると completion に結果 (usage を含む) が入り、キャッシュにも保存される。
+    途中で close() すると上流の HTTP レスポンスを閉じてリクエストを打ち切る。
+    n > 1 の場合は iter_choices() で (候補番号, 断片) を受け取る。
+    record を渡すと最初の断片までの時間を ttft、ストリーム終了までを network として記録する。
+    """
+
+    def __init__(self, client, model, messages, cache=None, bypass_cache=False, record=None, **params):
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.params = params
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.record = record
+        self.completion = None
+        self._response = None
+        self._usage = None
+
+    def __iter__(self):
+        for index, delta in self.iter_choices():
+            if index == 0:
+                yield delta
+
+    def iter_choices(self):
+        key, hit = _cache_lookup(self.cache, self.bypass_cache, self.model, self.messages, self.params)
+        if hit is not None:
+            yield from self._replay(hit)
+            return
+
+        started = time.perf_counter()
+        parts = {}
+        try:
+            self._response = self.client.chat.completions.create(**self._create_params())
+            for chunk in self._response:
+                yield from self._accumulate(chunk, parts, started)
+        except GeneratorExit:
+            _finish(self.record, "cancelled")
+            raise
+        except Exception as e:
+            _finish(self.record, type(e).__name__)
+            raise
+        finally:
+            self._close_response()
+
+        _cache_store(self.cache, key, self._finish_stream(parts, started))
+        _finish(self.record, "ok", self.completion)
+
+    # 以下は AsyncChatStream と共通の処理 (キャッシュ・HTTP の入出力を含まない)
+    def _create_params(self):
+        """ストリーミング呼び出しの引数を返す (前回の usage もここで捨てる)"""
+        self._usage = None
+        return dict(model=self.model, messages=self.messages, stream=True,
+                    stream_options={"include_usage": True}, **self.params)
+
+    def _replay(self, hit):
+        """キャッシュにあった結果を (候補番号, 本文) として返す"""
+        self.completion = hit
+        _finish(self.record, "cached", hit)
+        return list(enumerate(hit.choices))
+
+    def _accumulate(self, chunk, parts, started):
+        """チャンクの断片を parts に加え、(候補番号, 断片) のリストを返す"""
+        if chunk.usage is not None:
+            self._usage = chunk.usage
+        deltas = []
+        for choice in chunk.choices:
+            if choice.delta.content:
+                if not parts and self.record is not None:
+                    self.record.mark("ttft", started)
+                parts.setdefault(choice.index, []).append(choice.delta.content)
+                deltas.append((choice.index, choice.delta.content))
+        return deltas
+
+    def _finish_stream(self, parts, started):
+        """読み切った断片から completion を組み立てて返す"""
+        if self.record is not None:
+            self.record.mark("network", started)
+        choices = ["".join(parts.get(i, [])) for i in range(max(parts, default=0) + 1)]
+        self.completion = Completion(choices[0], _usage_dict(self._usage), choices=choices)
+        return self.completion
+
+    def _close_response(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def close(self):
+        """上流のレスポンスを閉じる。読み切る前なら cancelled として記録する"""
+        self._close_response()
+        if self.completion is None:
+            _finish(self.record, "cancelled")
+
+
+def stream_chat_completion(client, model, messages, cache=None, bypass_cache=False, record=None, **params):
+    """chat_completion のストリーミング版。ChatStream を返す"""
+    return ChatStream(client, model, messages, cache=cache, bypass_cache=bypass_cache, record=record, **params)
+
+
+class AsyncChatStream(ChatStream):
+    """ChatStream の非同期版 (client は AsyncOpenAI)。async for で断片を受け取る"""
+
+    async def __aiter__(self):
+        async for index, delta in self.aiter_choices():
+            if index == 0:
+                yield delta
+
+    async def aiter_choices(self):
+        key, hit = await _acache_lookup(self.cache, self.bypass_cache, self.model, self.messages, self.params)
+        if hit is not None:
+            for index, content in self._replay(hit):
+                yield index, content
+            return
+
+        started = time.perf_counter()
+        parts = {}
+        try:
+            self._response = await self.client.chat.completions.create(**self._create_params())
+            async for chunk in self._response:
+                for index, delta in self._accumulate(chunk, parts, started):
+                    yield index, delta
+        except GeneratorExit:
+            _finish(self.record, "cancelled")
+            raise
+        except Exception as e:
+            _finish(self.record, type(e).__name__)
+            raise
+        finally:
+            await self._aclose_response()
+
+        await _acache_store(self.cache, key, self._finish_stream(parts, started))
+        _finish(self.record, "ok", self.completion)
+
+    async def _aclose_response(self):
+        if self._response is not None:
+            response, self._response = self._response, None
+            await response.close()
+
+    async def aclose(self):
+        await self._aclose_response()
+        if self.completion is None:
+            _finish(self.record, "cancelled")
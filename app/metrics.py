@@ -0,0 +1,222 @@
+"""API 呼び出しごとの所要時間・トークン数の計測と公開
+
+抽出・生成の 1 呼び出しを CallRecord で表し、段階別の時間 (render / network / ttft / total)、
+入出力トークン数、モデル、結果 (ok / cached / cancelled / 例外クラス名) を記録する。
+Metrics は種別・モデルごとのカウンターとヒストグラムを保持し、
+サイドバー表示用の集計、Prometheus 形式のテキスト、JSONL のログとして出力する。
+"""
+import bisect
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_METRICS_PORT = os.environ.get("MAIL_GPT_METRICS_PORT")  # 未設定ならエンドポイントを起動しない
+DEFAULT_METRICS_LOG = os.environ.get("MAIL_GPT_METRICS_LOG")    # 未設定なら JSONL ログを書かない
+LATENCY_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # 秒
+
+
+class Histogram:
+    """バケットごとの件数 (非累積) と合計値を持つ単純なヒストグラム"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class CallRecord:
+    """1 回の API 呼び出しの計測値。finish() で Metrics に登録される (2 回目以降は無視)"""
+
+    def __init__(self, metrics, kind, model):
+        self.metrics = metrics
+        self.kind = kind
+        self.model = model
+        self.stages = {}
+        self.usage = {}
+        self.outcome = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, started)
+
+    def mark(self, name, since):
+        """since (perf_counter の値) から現在までを段階 name の時間 (ms) として記録する"""
+        self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - since) * 1000
+
+    def finish(self, outcome="ok", usage=None):
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        self.usage = dict(usage or {})
+        self.stages["total"] = (time.perf_counter() - self._started) * 1000
+        if self.metrics is not None:
+            self.metrics.add(self)
+
+    def as_dict(self):
+        return {
+            "ts": time.time(),
+            "kind": self.kind,
+            "model": self.model,
+            "outcome": self.outcome,
+            "stages_ms": {name: round(ms, 3) for name, ms in self.stages.items()},
+            "usage": self.usage,
+        }
+
+
+def start_call(metrics, kind, model):
+    """計測を開始する。metrics が None なら登録しない CallRecord を返す"""
+    return CallRecord(metrics, kind, model)
+
+
+class Metrics:
+    """プロセス内で共有する計測値の集計 (スレッドセーフ)"""
+
+    def __init__(self, window=500, log_path=DEFAULT_METRICS_LOG):
+        self.log_path = log_path
+        self._requests = {}    # (kind, model, outcome) -> 件数
+        self._tokens = {}      # (kind, model, 種類) -> トークン数
+        self._histograms = {}  # (kind, model, stage) -> Histogram
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self._log = open(log_path, "a", encoding="utf-8")
+
+    def add(self, record):
+        row = record.as_dict()
+        with self._lock:
+            key = (record.kind, record.model, record.outcome)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._recent.append(row)
+            if self._log is not None:
+                self._log.write(json.dumps(row, ensure_ascii=False) + "\n")
+                self._log.flush()
+            if record.outcome == "cached":
+                # キャッシュヒットは API を呼んでいない (課金されていない) ため、件数だけ数える
+                return
+            for name, value in record.usage.items():
+                if name.endswith("_tokens") and name != "total_tokens":
+                    token_key = (record.kind, record.model, name[: -len("_tokens")])
+                    self._tokens[token_key] = self._tokens.get(token_key, 0) + value
+            if record.outcome == "cancelled":
+                # 途中で打ち切った呼び出しの時間は応答の長さを反映しないため、ヒストグラムに含めない
+                return
+            for stage, ms in record.stages.items():
+                hist = self._histograms.get((record.kind, record.model, stage))
+                if hist is None:
+                    hist = self._histograms[(record.kind, record.model, stage)] = Histogram()
+                hist.observe(ms / 1000)
+
+    def summary(self):
+        """種別・モデルごとの集計を返す。時間の分位点は直近 window 件から求める"""
+        with self._lock:
+            recent = list(self._recent)
+            requests = dict(self._requests)
+        rows = {}
+        for (kind, model, outcome), count in requests.items():
+            row = rows.setdefault((kind, model), {
+                "kind": kind, "model": model, "calls": 0, "cached": 0, "errors": 0, "error_types": {},
+            })
+            row["calls"] += count
+            if outcome == "cached":
+                row["cached"] += count
+            elif outcome not in ("ok", "cancelled"):
+                row["errors"] += count
+                row["error_types"][outcome] = count
+        for (kind, model), row in rows.items():
+            # キャッシュヒットは API を呼んでいないため時間・トークンの集計から除く
+            calls = [r for r in recent if r["kind"] == kind and r["model"] == model and r["outcome"] == "ok"]
+            for stage in ("total", "ttft"):
+                values = sorted(r["stages_ms"][stage] for r in calls if stage in r["stages_ms"])
+                row[f"{stage}_p50_ms"] = statistics.median(values) if values else None
+                row[f"{stage}_p95_ms"] = values[min(len(values) - 1, int(len(values) * 0.95))] if values else None
+            for name in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                values = [r["usage"][name] for r in calls if name in r["usage"]]
+                row[f"avg_{name}"] = statistics.fmean(values) if values else None
+            # 入力トークンのうちプロバイダー側のプロンプトキャッシュに一致した割合
+            reported = [r["usage"] for r in calls if "cached_tokens" in r["usage"] and r["usage"].get("prompt_tokens")]
+            prompt = sum(u["prompt_tokens"] for u in reported)
+            row["prompt_cache_ratio"] = sum(u["cached_tokens"] for u in reported) / prompt if prompt else None
+        return sorted(rows.values(), key=lambda r: (r["kind"], r["model"]))
+
+    def recent(self, limit=20):
+        with self._lock:
+            return list(self._recent)[-limit:]
+
+    def prometheus(self):
+        """Prometheus のテキスト形式で出力する"""
+        def labels(**values):
+            return ",".join(f'{name}="{value}"' for name, value in values.items())
+
+        with self._lock:
+            lines = [
+                "# HELP mail_gpt_requests_total API calls by kind, model and outcome.",
+                "# TYPE mail_gpt_requests_total counter",
+            ]
+            for (kind, model, outcome), count in sorted(self._requests.items()):
+                lines.append(f"mail_gpt_requests_total{{{labels(kind=kind, model=model, outcome=outcome)}}} {count}")
+            lines += [
+                "# HELP mail_gpt_tokens_total Tokens reported by the API (response-cache hits excluded).",
+                "# TYPE mail_gpt_tokens_total counter",
+            ]
+            for (kind, model, token_type), count in sorted(self._tokens.items()):
+                lines.append(f"mail_gpt_tokens_total{{{labels(kind=kind, model=model, type=token_type)}}} {count}")
+            lines += [
+                "# HELP mail_gpt_stage_duration_seconds Time spent per stage of an API call (response-cache hits and cancelled calls excluded).",
+                "# TYPE mail_gpt_stage_duration_seconds histogram",
+            ]
+            for (kind, model, stage), hist in sorted(self._histograms.items()):
+                base = labels(kind=kind, model=model, stage=stage)
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f'mail_gpt_stage_duration_seconds_bucket{{{base},le="{bound}"}} {cumulative}')
+                lines.append(f'mail_gpt_stage_duration_seconds_bucket{{{base},le="+Inf"}} {hist.count}')
+                lines.append(f"mail_gpt_stage_duration_seconds_sum{{{base}}} {hist.sum:.6f}")
+                lines.append(f"mail_gpt_stage_duration_seconds_count{{{base}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port, host="0.0.0.0"):
+    """/metrics (Prometheus 形式) と /metrics.json (集計) を返す HTTP サーバーを別スレッドで起動する"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.summary(), ensure_ascii=False), "application/json"
+            else:
+                self.send_error(404)
+                return
+            out = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,40 @@
+"""Streamlit スクリプト実行時間の計測"""
+import statistics
+import threading
+from collections import deque
+
+
+class ScriptTimer:
+    """プロセス初回 (コールドスタート) と以降の再実行にかかったスクリプト時間を記録する
+
+    API を呼んだ実行は時間の大半が API の待ち時間になるため、件数だけ数えて分位点には含めない。
+    """
+
+    def __init__(self, window=200):
+        self.cold_start_ms = None
+        self.api_runs = 0
+        self._runs = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms, api_called=False):
+        with self._lock:
+            if api_called:
+                self.api_runs += 1
+            elif self.cold_start_ms is None:
+                self.cold_start_ms = elapsed_ms
+            else:
+                self._runs.append(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            runs = sorted(self._runs)
+        if not runs:
+            return {"cold_start_ms": self.cold_start_ms, "reruns": 0, "api_runs": self.api_runs,
+                    "rerun_p50_ms": None, "rerun_p95_ms": None}
+        return {
+            "cold_start_ms": self.cold_start_ms,
+            "reruns": len(runs),
+            "api_runs": self.api_runs,
+            "rerun_p50_ms": statistics.median(runs),
+            "rerun_p95_ms": runs[min(len(runs) - 1, int(len(runs) * 0.95))],
+        }
@@ -0,0 +1,237 @@
+"""貼り付けられたメール (スレッド) の前処理
+
+プロンプトに入れる前に、行単位のジェネレーターを順につないで次の処理を行う。
+1. 短い区切り線 (---) でメールごとに分割し、引用行 (> で始まる行) と、-----Original Message-----・
+   「On ... wrote:」などから次の区切り線までの返信・転送の履歴 (相手のメール) を取り除く
+2. 転送時のヘッダー行、法務上の定型フッターを取り除き、行末の空白を詰める
+3. 完全一致・ほぼ一致 (MinHash) のメールを取り除く
+4. 同じ署名は最初の 1 回だけ残す (送信者自身の結びと署名は文体の特徴なので残す)
+5. トークン数の上限に収まるまでのメールだけを残す (1 通目が上限を超える場合は切り詰める)
+"""
+import hashlib
+import re
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+from tokens import estimate_tokens
+
+DEFAULT_TOKEN_BUDGET = 8000
+MAX_TOKEN_BUDGET = 64000  # 画面・HTTP サービスで指定できる上限
+MESSAGE_SEPARATOR = "\n\n---\n\n"  # corpus.split_emails で再分割できる区切り
+SHINGLE = 5
+NUM_PERM = 64
+NEAR_DUPLICATE = 0.8  # MinHash で推定した Jaccard 係数がこれ以上なら重複とみなす
+LSH_BANDS = 8  # シグネチャを分割するバンド数 (1 バンド NUM_PERM // LSH_BANDS 行、候補になるしきい値は約 0.77)
+SIGNATURE_WINDOW = 12  # 署名を探すメール末尾の行数
+
+# 返信・転送で付いてくる過去のやり取り (相手のメール) の開始を示す行。ここから次の区切り線までを捨てる
+REPLY_HISTORY = re.compile(
+    r"^\s*(?:-{2,}\s*(?:Original Message|Forwarded message|元のメッセージ|転送されたメッセージ)\s*-{2,}"
+    r"|On .{4,200}wrote:"
+    r"|\d{4}[/年-]\s*\d{1,2}[/月-]\s*\d{1,2}.{0,200}(?:wrote|書きました|のメッセージ)[:：]?)\s*$",
+    re.IGNORECASE,
+)
+# 送信者自身のメール同士の区切り (短い区切り線のみ。長い罫線は署名の枠として扱う)
+MESSAGE_BOUNDARY = re.compile(r"^\s*(?:-{3,6}|={3,6}|_{3,6}|#{3,6})\s*$")
+QUOTED = re.compile(r"^\s*[>＞|]")
+HEADER = re.compile(r"^\s*(?:From|Sent|To|Cc|Date|Subject|差出人|送信者|送信日時|日時|宛先|件名)\s*[:：]", re.IGNORECASE)
+SIGNATURE_START = re.compile(r"^(?:--\s?|[-=＝─━*＊_～~]{5,}.*|[-=＝─━*＊]{2,}.{1,40}[-=＝─━*＊]{2,})$")
+# 署名の後ろに付く法務上の定型文 (単語単位ではなく定型の言い回しで判定する)
+LEGAL_FOOTER = re.compile(
+    r"本メール(?:の内容|及び|および|には|は).{0,40}(?:機密|秘密|守秘|第三者|無断)"
+    r"|誤って(?:本メールを)?(?:受信|受け取|届いた)|誤送信.{0,20}(?:場合|削除|破棄)"
+    r"|intended (?:solely )?(?:only )?(?:for )?(?:the )?(?:use of the )?(?:named )?(?:addressee|recipient)"
+    r"|confidentiality notice|^\s*disclaimer\s*[:：]",
+    re.IGNORECASE,
+)
+
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(0)
+# crc32 (32 bit) との積が uint64 に収まるよう係数も 32 bit にする
+_PERM_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+
+@dataclass
+class PreprocessResult:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    messages: int = 0
+    duplicates: int = 0
+    quoted_lines: int = 0
+    signatures: int = 0   # 取り除いた重複署名の数
+    truncated: bool = False
+
+
+def _split_messages(lines, stats):
+    """行のストリームをメールごとの行リストに分ける (引用行と返信・転送の履歴は捨てる)"""
+    message = []
+    in_history = False
+    for line in lines:
+        if MESSAGE_BOUNDARY.match(line):
+            if message:
+                yield message
+            message = []
+            in_history = False
+            continue
+        if in_history or REPLY_HISTORY.match(line) or QUOTED.match(line):
+            # 過去のやり取りは相手の文体なので、次の区切り線まで分析に含めない
+            in_history = in_history or bool(REPLY_HISTORY.match(line))
+            if line.strip():
+                stats.quoted_lines += 1
+            continue
+        message.append(line.rstrip())
+    if message:
+        yield message
+
+
+def _strip_legal_footer(lines):
+    """署名より後ろにある末尾の段落のうち、法務上の定型文を含むものを取り除く
+
+    署名 (SIGNATURE_START の最後の行) が見つからない場合や、それより前の行は取り除かない。
+    """
+    signature = next((i for i in range(len(lines) - 1, -1, -1) if SIGNATURE_START.match(lines[i].strip())), None)
+    if signature is None:
+        return lines
+    floor = signature + 1
+    end = len(lines)
+    while True:
+        while end > floor and not lines[end - 1].strip():
+            end -= 1
+        para = end
+        while para > floor and lines[para - 1].strip():
+            para -= 1
+        hits = [i for i in range(para, end) if LEGAL_FOOTER.search(lines[i])]
+        if not hits:
+            break
+        if para == floor:
+            # 署名と空行なしで続く定型文は、最初に一致した行から取り除く
+            end = hits[0]
+            break
+        end = para
+    return lines[:end]
+
+
+def _clean(messages):
+    """先頭のヘッダー行・末尾の法務フッター・余分な空行を取り除く"""
+    for lines in messages:
+        start = 0
+        while start < len(lines) and (not lines[start].strip() or HEADER.match(lines[start])):
+            start += 1
+        lines = _strip_legal_footer(lines[start:])
+        out = []
+        for line in lines:
+            if line.strip() or (out and out[-1]):
+                out.append(line)
+        while out and not out[-1]:
+            out.pop()
+        if out:
+            yield out
+
+
+def _dedupe_signatures(messages, stats):
+    """末尾の署名ブロックを検出し、2 回目以降に現れた同じ署名を取り除く"""
+    seen = set()
+    for lines in messages:
+        for i in range(max(0, len(lines) - SIGNATURE_WINDOW), len(lines)):
+            if SIGNATURE_START.match(lines[i].strip()):
+                key = "".join("".join(lines[i:]).split())
+                if key in seen:
+                    stats.signatures += 1
+                    lines = lines[:i]
+                    while lines and not lines[-1]:
+                        lines.pop()
+                else:
+                    seen.add(key)
+                break
+        if lines:
+            yield "\n".join(lines)
+
+
+def minhash(text):
+    """文字 SHINGLE-gram の MinHash シグネチャ (NUM_PERM 個の uint64)"""
+    compact = "".join(text.split())
+    shingles = {compact[i:i + SHINGLE] for i in range(max(1, len(compact) - SHINGLE + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(hashes, _PERM_A) + _PERM_B) % _PRIME).min(axis=0)
+
+
+def _dedupe_messages(messages, stats):
+    """完全一致と、LSH (MinHash のバンド分割) で候補に挙がったほぼ一致のメールを取り除く"""
+    exact = set()
+    buckets = {}
+    rows = NUM_PERM // LSH_BANDS
+    for lines in messages:
+        text = "\n".join(lines)
+        digest = hashlib.sha1("".join(text.split()).encode("utf-8")).digest()
+        if digest in exact:
+            stats.duplicates += 1
+            continue
+        signature = minhash(text)
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+        candidates = {id(other): other for key in keys for other in buckets.get(key, ())}
+        if any(float(np.mean(signature == other)) >= NEAR_DUPLICATE for other in candidates.values()):
+            stats.duplicates += 1
+            continue
+        exact.add(digest)
+        for key in keys:
+            buckets.setdefault(key, []).append(signature)
+        yield lines
+
+
+def _truncate(text, budget):
+    """text の先頭から budget トークン以内に収まる部分を返す (行単位、収まらない行は文字単位で切る)"""
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        tokens = estimate_tokens(line) + 1
+        if used + tokens > budget:
+            rest = budget - used - 1
+            chars = len(line)
+            while chars > 0 and estimate_tokens(line[:chars]) > rest:
+                chars = min(chars - 1, chars * rest // max(1, estimate_tokens(line[:chars])))
+            if chars > 0:
+                kept.append(line[:chars])
+            break
+        used += tokens
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _budget(messages, budget, stats):
+    """budget (None なら無制限) に収まるまでのメールを返す"""
+    used = 0
+    for text in messages:
+        tokens = estimate_tokens(text) + (estimate_tokens(MESSAGE_SEPARATOR) if used else 0)
+        if budget is not None and used + tokens > budget:
+            stats.truncated = True
+            if used == 0:
+                # 1 通目が上限を超える場合は上限まで切り詰める
+                kept = _truncate(text, budget)
+                if kept:
+                    stats.messages += 1
+                    yield kept
+            return
+        used += tokens
+        stats.messages += 1
+        yield text
+
+
+def preprocess_email(text, token_budget=DEFAULT_TOKEN_BUDGET):
+    """貼り付けられたテキストを前処理し、PreprocessResult を返す
+
+    token_budget=None なら上限で切り詰めない (コーパスモードのように後段で分割する場合)。
+    """
+    text = text.replace("\r\n", "\n")
+    stats = PreprocessResult("", estimate_tokens(text), 0)
+    pipeline = _split_messages(iter(text.split("\n")), stats)
+    pipeline = _clean(pipeline)
+    pipeline = _dedupe_messages(pipeline, stats)
+    pipeline = _dedupe_signatures(pipeline, stats)
+    pipeline = _budget(pipeline, token_budget, stats)
+    stats.text = MESSAGE_SEPARATOR.join(pipeline)
+    stats.tokens_after = estimate_tokens(stats.text)
+    return stats
@@ -0,0 +1,72 @@
+"""プロンプトテンプレートの読み込みとレンダリング (UI・バッチ処理で共通)"""
+import os
+
+from jinja2 import Environment, FileSystemLoader
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# テンプレートはプロセス内で一度だけコンパイルする (MAIL_GPT_TEMPLATE_RELOAD=1 で編集を即時反映)
+env = Environment(
+    loader=FileSystemLoader(os.path.join(BASE_DIR, "prompts")),
+    autoescape=False,
+    auto_reload=os.environ.get("MAIL_GPT_TEMPLATE_RELOAD") == "1",
+)
+
+# メールの目的
+EMAIL_PURPOSES = [
+    "一般的な連絡",
+    "お詫び・謝罪",
+    "依頼・お願い",
+    "お礼・感謝",
+    "案内・招待",
+    "報告・進捗共有",
+    "質問・確認",
+    "スケジュール調整",
+    "お祝い・慶事",
+    "クレーム対応"
+]
+LENGTHS = ["短め", "標準", "詳細"]
+
+
+def render_style_prompt(email_text):
+    return env.get_template("style_rules_prompt.jinja2").render(email_text=email_text)
+
+
+def render_merge_prompt(partial_rules, min_lines=8, max_lines=12):
+    return env.get_template("style_rules_merge_prompt.jinja2").render(
+        partial_rules=partial_rules, min_lines=min_lines, max_lines=max_lines
+    )
+
+
+def render_generate_prefix(purpose):
+    """目的ごとの固定部分 (指示・目的別ポイント)。リクエストごとの値を含まない"""
+    return env.get_template("email_generate_prefix.jinja2").render(purpose=purpose)
+
+
+# 目的ごとの固定部分は起動時に一度だけレンダリングし、以降は同じ文字列を使う
+GENERATE_PREFIXES = {purpose: render_generate_prefix(purpose) for purpose in EMAIL_PURPOSES}
+
+
+def generate_prefix(purpose):
+    if env.auto_reload:
+        return render_generate_prefix(purpose)
+    prefix = GENERATE_PREFIXES.get(purpose)
+    return prefix if prefix is not None else render_generate_prefix(purpose)
+
+
+def render_generate_prompt(style_rules, user_request, recipient="", formality=3, length="標準", purpose=EMAIL_PURPOSES[0]):
+    """固定部分 → 文体ルール → リクエストごとの値 の順に並べたメール生成プロンプト
+
+    system メッセージと固定部分が先頭にそろうため、同じ目的のリクエストは長い共通の接頭辞を持ち、
+    プロバイダー側のプロンプトキャッシュ (usage の cached_tokens) が効く。
+    """
+    additional_info = {
+        "recipient": recipient or "",
+        "formality": formality,
+        "length": length,
+        "purpose": purpose
+    }
+    return generate_prefix(purpose) + env.get_template("email_generate_request.jinja2").render(
+        style_rules=style_rules,
+        user_request=user_request,
+        additional_info=additional_info
+    )
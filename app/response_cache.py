@@ -0,0 +1,121 @@
+"""LLM 応答のディスクキャッシュ (SQLite)。
+
+レンダリング済みプロンプト・system メッセージ・モデル・サンプリングパラメータの
+ハッシュをキーに応答を保存する。SQLite ファイルを共有するため、Streamlit の
+セッション間・プロセス間で同じキャッシュが使われる。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "MAIL_GPT_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "mail_gpt_gen", "responses.sqlite3"),
+)
+DEFAULT_MAX_ENTRIES = int(os.environ.get("MAIL_GPT_CACHE_MAX_ENTRIES", "2000"))
+DEFAULT_MAX_AGE = float(os.environ.get("MAIL_GPT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+
+def make_key(model, messages, **params):
+    """モデル・メッセージ・サンプリングパラメータから決定的なキャッシュキーを作る"""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """件数上限 (LRU) と有効期限で追い出す、プロセス間共有の応答キャッシュ"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def get(self, key):
+        """キャッシュ済みの応答 (dict) を返す。期限切れ・未登録なら None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._bump("misses")
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self._bump("hits")
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """応答 (JSON 化可能な dict) を保存し、上限を超えた分を追い出す"""
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, data, now, now),
+            )
+            self._evict(now)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM counters")
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """このプロセスと全プロセス合計のヒット/ミス数、保存件数を返す"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            totals = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+            "entries": entries,
+        }
+
+    def _bump(self, name):
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
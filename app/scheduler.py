@@ -0,0 +1,309 @@
+"""プロセス内の全セッションで共有するレート制限対応のリクエストスケジューラ
+
+API キー × モデルごとに、1 分あたりのリクエスト数 (RPM) とトークン数 (TPM) のトークンバケットを持つ。
+トークン数はプロンプトの見積もりと max_tokens の合計で予約し、応答の usage が分かれば差分を返却する。
+待ち行列は利用者 (セッション) ごとに分け、ラウンドロビンで順番に払い出すため、
+大量のリクエストを投げた利用者がいても他の利用者の 1 件が後回しにならない。
+429 / 5xx / 接続エラーは Retry-After (なければ full jitter の指数バックオフ) だけ待って再試行し、
+429 の場合は同じキー・モデルの全リクエストをその間止める。
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from tokens import estimate_tokens
+
+DEFAULT_RPM = float(os.environ.get("MAIL_GPT_RATE_LIMIT_RPM", "500"))
+DEFAULT_TPM = float(os.environ.get("MAIL_GPT_RATE_LIMIT_TPM", "200000"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("MAIL_GPT_MAX_RETRIES", "5"))
+DEFAULT_MAX_TOKENS = 1000  # max_tokens 未指定時に予約する出力トークン数
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+POLL_INTERVAL = 0.25  # 待機中に順番 (on_wait) を通知する間隔
+
+RETRYABLE_ERRORS = ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError")
+
+
+def is_retryable(e):
+    status = getattr(e, "status_code", None)
+    return type(e).__name__ in RETRYABLE_ERRORS or status in (408, 409, 429) or (status or 0) >= 500
+
+
+def retry_after(e):
+    """例外のレスポンスヘッダーから Retry-After (秒) を読み取る。なければ None"""
+    response = getattr(e, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def estimate_request_tokens(messages, max_tokens=None, n=1):
+    """レンダリング済みのプロンプトと max_tokens (n 件分) から予約するトークン数を見積もる"""
+    prompt = sum(estimate_tokens(m.get("content") or "") for m in messages)
+    return prompt + (max_tokens or DEFAULT_MAX_TOKENS) * n
+
+
+class TokenBucket:
+    """毎分 rate ずつ補充され、最大 rate まで貯まるバケット"""
+
+    def __init__(self, rate_per_min):
+        self.rate = rate_per_min / 60.0
+        self.capacity = rate_per_min
+        self.level = rate_per_min
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """amount を取り出せるまでの秒数 (容量を超える要求は満杯になれば取り出せるものとする)"""
+        self._refill(now)
+        need = min(amount, self.capacity) - self.level
+        return max(0.0, need / self.rate)
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    def __init__(self, user, tokens):
+        self.user = user
+        self.tokens = tokens
+
+
+class _Lane:
+    """API キー × モデルごとのバケットと、利用者ごとの待ち行列"""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queues = OrderedDict()  # user -> deque[_Ticket] (先頭の利用者が次の払い出し対象)
+        self.paused_until = 0.0
+
+    def next_ticket(self):
+        for queue in self.queues.values():
+            if queue:
+                return queue[0]
+        return None
+
+    def position(self, ticket):
+        """ラウンドロビンで払い出した場合に ticket より前に出る件数"""
+        users = list(self.queues)
+        queue = self.queues[ticket.user]
+        depth = queue.index(ticket)
+        ahead = 0
+        for user in users:
+            other = len(self.queues[user])
+            if user == ticket.user:
+                ahead += depth
+            elif users.index(user) < users.index(ticket.user):
+                ahead += min(other, depth + 1)
+            else:
+                ahead += min(other, depth)
+        return ahead
+
+    def wait_time(self, ticket, now):
+        return max(
+            self.paused_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(ticket.tokens, now),
+        )
+
+    def grant(self, ticket):
+        self.requests.take(1)
+        self.tokens.take(ticket.tokens)
+        self.queues[ticket.user].popleft()
+        # 払い出した利用者を最後尾に回す
+        self.queues.move_to_end(ticket.user)
+        if not self.queues[ticket.user]:
+            del self.queues[ticket.user]
+
+
+class Scheduler:
+    """スレッドセーフな共有スケジューラ。client() でスケジュール付きのクライアントを作る"""
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_retries=DEFAULT_MAX_RETRIES, limits=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.limits = dict(limits or {})  # モデル名 -> (rpm, tpm) の個別設定
+        self._lanes = {}
+        self._cond = threading.Condition()
+        self._stats = {"granted": 0, "retries": 0, "throttled": 0, "failed": 0}
+
+    def _lane(self, key, model):
+        lane = self._lanes.get((key, model))
+        if lane is None:
+            rpm, tpm = self.limits.get(model, (self.rpm, self.tpm))
+            lane = self._lanes[(key, model)] = _Lane(rpm, tpm)
+        return lane
+
+    def acquire(self, key, model, user, tokens, on_wait=None):
+        """順番が来てバケットに余裕ができるまで待つ
+
+        待機中は on_wait(前に並んでいる件数) を繰り返し呼び、待った場合は払い出し後に on_wait(None) を呼ぶ。
+        """
+        waited = False
+        with self._cond:
+            lane = self._lane(key, model)
+            ticket = _Ticket(user, tokens)
+            lane.queues.setdefault(user, deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if lane.next_ticket() is ticket:
+                        wait = lane.wait_time(ticket, now)
+                        if wait <= 0:
+                            lane.grant(ticket)
+                            self._stats["granted"] += 1
+                            self._cond.notify_all()
+                            break
+                    else:
+                        wait = POLL_INTERVAL
+                    waited = True
+                    if on_wait is not None:
+                        position = lane.position(ticket)
+                        self._cond.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self._cond.acquire()
+                    self._cond.wait(min(wait, POLL_INTERVAL))
+            except BaseException:
+                # 中断された場合は自分の予約を取り下げる
+                queue = lane.queues.get(user)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del lane.queues[user]
+                    self._cond.notify_all()
+                raise
+        if waited and on_wait is not None:
+            on_wait(None)
+
+    def settle(self, key, model, reserved, used):
+        """予約したトークン数と実際の使用量の差を返却する"""
+        with self._cond:
+            lane = self._lane(key, model)
+            if used < reserved:
+                lane.tokens.give_back(reserved - used)
+            else:
+                lane.tokens.take(used - reserved)
+            self._cond.notify_all()
+
+    def throttle(self, key, model, seconds):
+        """429 を受けたキー・モデルの全リクエストを seconds 秒止める"""
+        with self._cond:
+            lane = self._lane(key, model)
+            lane.paused_until = max(lane.paused_until, time.monotonic() + seconds)
+            self._stats["throttled"] += 1
+
+    def call(self, key, model, user, tokens, fn, on_wait=None):
+        """acquire してから fn() を呼び、再試行可能なエラーはバックオフして並び直す"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(key, model, user, tokens, on_wait)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    with self._cond:
+                        self._stats["failed"] += 1
+                    raise
+                # サーバーが Retry-After を返した場合はそれに従い、なければ full jitter の指数バックオフ
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                if getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError":
+                    self.throttle(key, model, delay)
+                with self._cond:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+
+    def stats(self):
+        with self._cond:
+            waiting = sum(len(q) for lane in self._lanes.values() for q in lane.queues.values())
+            return dict(self._stats, waiting=waiting)
+
+    def client(self, client, user, on_wait=None):
+        return ScheduledClient(self, client, user, on_wait)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, owner):
+        self.completions = _Completions(owner)
+
+
+class ScheduledClient:
+    """OpenAI クライアントの chat.completions.create をスケジューラ経由にするラッパー
+
+    llm.chat_completion などにそのまま渡せる。client 自身の再試行は無効 (max_retries=0) にしておく。
+    """
+
+    def __init__(self, scheduler, client, user, on_wait=None):
+        self.scheduler = scheduler
+        self.client = client
+        self.user = user
+        self.on_wait = on_wait
+        self.chat = _Chat(self)
+        self._key = hashlib.sha256(str(client.api_key).encode("utf-8")).hexdigest()
+
+    def _create(self, **kwargs):
+        model = kwargs["model"]
+        reserved = estimate_request_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"), kwargs.get("n", 1))
+        res = self.scheduler.call(
+            self._key, model, self.user, reserved,
+            lambda: self.client.chat.completions.create(**kwargs),
+            on_wait=self.on_wait,
+        )
+        def settle(used):
+            self.scheduler.settle(self._key, model, reserved, used)
+
+        if kwargs.get("stream"):
+            # ストリーミングでは usage は最後のチャンク (include_usage) で届く
+            return _SettlingStream(res, settle)
+        usage = getattr(res, "usage", None)
+        if usage is not None:
+            settle(usage.total_tokens)
+        return res
+
+
+class _SettlingStream:
+    """openai の Stream を包み、usage 付きのチャンクが届いたら予約トークンを精算する
+
+    途中で閉じられて usage が届かなかった場合は、使用量が分からないため予約分をそのまま消費したものとする。
+    """
+
+    def __init__(self, stream, settle):
+        self._stream = stream
+        self._settle = settle
+
+    def __iter__(self):
+        for chunk in self._stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None and self._settle is not None:
+                self._settle(usage.total_tokens)
+                self._settle = None
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
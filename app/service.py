@@ -0,0 +1,268 @@
+"""スタイル抽出・メール生成のヘッドレス HTTP サービス (Starlette + uvicorn)
+
+使い方:
+    python app/service.py --host 0.0.0.0 --port 8000 --workers 4
+
+エンドポイント:
+    GET  /healthz              死活確認
+    GET  /v1/options           メールの目的・長さ・モデルの選択肢
+    POST /v1/extract           {"email", "model", "preprocess", "token_budget"} -> {"style_rules", ...}
+    POST /v1/generate          {"style_rules", "request", "recipient", "formality", "length", "purpose", ...}
+    POST /v1/generate/stream   /v1/generate と同じ入力で、断片を Server-Sent Events で返す
+    GET  /metrics              このワーカーの計測値 (Prometheus 形式)
+
+API キーは Authorization: Bearer ヘッダーから読み込む (ない場合は 401)。--allow-env-key (MAIL_GPT_SERVICE_ALLOW_ENV_KEY=1) を
+指定した場合だけ、ヘッダーのないリクエストにサーバーの環境変数 OPENAI_API_KEY を使う (認証なしで使えるため、
+信頼できるネットワーク内でのみ有効にする)。
+ワーカーが持つ状態はクライアントプール・応答キャッシュ (プロセス間で共有の SQLite)・計測値だけなので、
+ロードバランサーの背後で任意の台数に増やせる。
+"""
+import argparse
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from assets import MODELS
+from client_pool import AsyncClientPool
+from llm import SYSTEM_EXTRACT, SYSTEM_GENERATE, AsyncChatStream, achat_completion, build_messages, error_message
+from metrics import Metrics, start_call
+from preprocess import DEFAULT_TOKEN_BUDGET, MAX_TOKEN_BUDGET, preprocess_email
+from prompt_templates import BASE_DIR, EMAIL_PURPOSES, LENGTHS, render_generate_prompt, render_style_prompt
+from response_cache import ResponseCache
+
+DEFAULT_HOST = os.environ.get("MAIL_GPT_SERVICE_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("MAIL_GPT_SERVICE_PORT", "8000"))
+DEFAULT_WORKERS = int(os.environ.get("MAIL_GPT_SERVICE_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_MODEL = MODELS[0]
+MAX_BODY_BYTES = 1_000_000
+FORMALITY_RANGE = (1, 5)
+ALLOW_ENV_KEY = os.environ.get("MAIL_GPT_SERVICE_ALLOW_ENV_KEY") == "1"
+
+# ワーカー (プロセス) ごとに 1 つずつ持つ
+clients = AsyncClientPool()
+cache = None if os.environ.get("MAIL_GPT_SERVICE_NO_CACHE") == "1" else ResponseCache()
+metrics = Metrics()
+
+
+class RequestError(ValueError):
+    """入力の誤り (400 で返す)"""
+
+
+class AuthError(RequestError):
+    """API キーの指定がない (401 で返す)"""
+
+
+def _error_response(e):
+    if isinstance(e, RequestError):
+        return JSONResponse({"error": str(e)}, status_code=401 if isinstance(e, AuthError) else 400)
+    name = type(e).__name__
+    status = getattr(e, "status_code", None)
+    if name == "RateLimitError":
+        code = 429
+    elif name == "AuthenticationError":
+        code = 401
+    elif status in (400, 403, 404):
+        code = status
+    else:
+        code = 502
+    return JSONResponse({"error": error_message(e), "type": name}, status_code=code)
+
+
+async def _read_json(request):
+    body = await request.body()
+    if len(body) > MAX_BODY_BYTES:
+        raise RequestError(f"リクエストが大きすぎます (上限 {MAX_BODY_BYTES} バイト)")
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise RequestError("JSON として読み込めません") from None
+    if not isinstance(data, dict):
+        raise RequestError("JSON オブジェクトを指定してください")
+    return data
+
+
+def _text(data, name, required=True):
+    value = data.get(name, "")
+    if not isinstance(value, str) or (required and not value.strip()):
+        raise RequestError(f"{name} は空でない文字列で指定してください" if required else f"{name} は文字列で指定してください")
+    return value
+
+
+def _number(data, name, default, kind, low=None, high=None):
+    value = data.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+        raise RequestError(f"{name} は数値で指定してください")
+    value = kind(value)
+    if low is not None and value < low:
+        raise RequestError(f"{name} は {low}〜{high} の範囲で指定してください" if high is not None
+                           else f"{name} は {low} 以上を指定してください")
+    if high is not None and value > high:
+        raise RequestError(f"{name} は {low}〜{high} の範囲で指定してください" if low is not None
+                           else f"{name} は {high} 以下を指定してください")
+    return value
+
+
+def _client(request):
+    auth = request.headers.get("authorization", "")
+    if auth.startswith("Bearer "):
+        api_key = auth[len("Bearer "):].strip()
+    else:
+        api_key = os.environ.get("OPENAI_API_KEY") if ALLOW_ENV_KEY else None
+    if not api_key:
+        raise AuthError("API キーがありません (Authorization: Bearer ヘッダーで指定してください)")
+    return clients.get(api_key)
+
+
+def _generate_params(data):
+    """生成リクエストを検証し、(モデル, メッセージ, サンプリングパラメータ) を返す"""
+    purpose = data.get("purpose", EMAIL_PURPOSES[0])
+    if purpose not in EMAIL_PURPOSES:
+        raise RequestError(f"purpose は {' / '.join(EMAIL_PURPOSES)} のいずれかを指定してください")
+    length = data.get("length", "標準")
+    if length not in LENGTHS:
+        raise RequestError(f"length は {' / '.join(LENGTHS)} のいずれかを指定してください")
+    prompt = render_generate_prompt(
+        _text(data, "style_rules"),
+        _text(data, "request"),
+        recipient=_text(data, "recipient", required=False),
+        formality=_number(data, "formality", 3, int, *FORMALITY_RANGE),
+        length=length,
+        purpose=purpose,
+    )
+    params = {
+        "temperature": _number(data, "temperature", 0.7, float, 0.0, 2.0),
+        "max_tokens": _number(data, "max_tokens", 2000, int, 1, 16000),
+    }
+    return _text(data, "model", required=False) or DEFAULT_MODEL, build_messages(SYSTEM_GENERATE, prompt), params
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def options(request):
+    return JSONResponse({
+        "purposes": EMAIL_PURPOSES,
+        "lengths": LENGTHS,
+        "models": MODELS,
+        "formality": list(FORMALITY_RANGE),
+    })
+
+
+async def extract(request):
+    try:
+        data = await _read_json(request)
+        model = _text(data, "model", required=False) or DEFAULT_MODEL
+        call = start_call(metrics, "extract", model)
+        with call.stage("render"):
+            text = _text(data, "email")
+            if data.get("preprocess", True):
+                budget = _number(data, "token_budget", DEFAULT_TOKEN_BUDGET, int, 1, MAX_TOKEN_BUDGET)
+                # 長いスレッドの前処理でイベントループを止めないよう、別スレッドで実行する
+                text = (await asyncio.to_thread(preprocess_email, text, budget)).text
+            messages = build_messages(SYSTEM_EXTRACT, render_style_prompt(text))
+        res = await achat_completion(
+            _client(request), model=model, messages=messages, cache=cache, record=call, temperature=0.3
+        )
+    except Exception as e:
+        return _error_response(e)
+    return JSONResponse({"style_rules": res.content, "model": model, "usage": res.usage, "cached": res.cached})
+
+
+async def generate(request):
+    try:
+        data = await _read_json(request)
+        model, messages, params = _generate_params(data)
+        call = start_call(metrics, "generate", model)
+        res = await achat_completion(_client(request), model=model, messages=messages, cache=cache, record=call, **params)
+    except Exception as e:
+        return _error_response(e)
+    return JSONResponse({"email": res.content, "model": model, "usage": res.usage, "cached": res.cached})
+
+
+def _sse(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def generate_stream(request):
+    """断片を data: {"delta": ...} で送り、最後に data: {"done": true, "usage": ...} を送る"""
+    try:
+        data = await _read_json(request)
+        model, messages, params = _generate_params(data)
+        client = _client(request)
+    except Exception as e:
+        return _error_response(e)
+    stream = AsyncChatStream(
+        client, model, messages, cache=cache, record=start_call(metrics, "generate_stream", model), **params
+    )
+
+    async def events():
+        try:
+            async for delta in stream:
+                yield _sse({"delta": delta})
+            yield _sse({"done": True, "usage": stream.completion.usage, "cached": stream.completion.cached})
+        except Exception as e:
+            # ヘッダー送信後のエラーはイベントとして通知する
+            yield _sse({"error": error_message(e), "type": type(e).__name__})
+        finally:
+            # クライアントが切断した場合は上流のリクエストも打ち切る
+            await stream.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def prometheus(request):
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await clients.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/healthz", healthz),
+        Route("/v1/options", options),
+        Route("/v1/extract", extract, methods=["POST"]),
+        Route("/v1/generate", generate, methods=["POST"]),
+        Route("/v1/generate/stream", generate_stream, methods=["POST"]),
+        Route("/metrics", prometheus),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="スタイル抽出・メール生成の HTTP サービス")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="ワーカープロセス数 (既定は CPU コア数)")
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--allow-env-key", action="store_true", default=ALLOW_ENV_KEY,
+                        help="Authorization ヘッダーのないリクエストに環境変数 OPENAI_API_KEY を使う")
+    args = parser.parse_args(argv)
+    if args.allow_env_key:
+        # ワーカープロセスは環境変数を引き継いで設定を読む
+        os.environ["MAIL_GPT_SERVICE_ALLOW_ENV_KEY"] = "1"
+    uvicorn.run(
+        "service:app",
+        app_dir=BASE_DIR,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""文体ルールの永続ライブラリ (SQLite) と類似スタイル検索
+
+抽出したルールを元メールのハッシュ・特徴ベクトル・作成日時とともに保存する。
+特徴ベクトルは文字 3-gram のハッシュベクトルと stylometry の特徴量を連結して正規化したもので、
+全件を NumPy 行列としてメモリに持ち、内積 1 回で最も近いスタイルを求める。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from stylometry import profile_batch
+
+DEFAULT_STYLE_DB_PATH = os.environ.get(
+    "MAIL_GPT_STYLE_DB_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "mail_gpt_gen", "styles.sqlite3"),
+)
+NGRAM = 3
+NGRAM_DIMS = 256
+FEATURE_WEIGHT = 0.5  # n-gram 部分に対する文体特徴量部分の重み
+
+
+def source_hash(text):
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def style_vectors(texts):
+    """メールのリストから L2 正規化済みの特徴ベクトル行列 (float32) を作る"""
+    grams = np.zeros((len(texts), NGRAM_DIMS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        compact = "".join(text.split())
+        buckets = [zlib.crc32(compact[i:i + NGRAM].encode("utf-8")) % NGRAM_DIMS for i in range(len(compact) - NGRAM + 1)]
+        if buckets:
+            grams[row] = np.bincount(buckets, minlength=NGRAM_DIMS)
+    grams /= np.maximum(np.linalg.norm(grams, axis=1, keepdims=True), 1e-9)
+
+    features = np.log1p(profile_batch(texts)).astype(np.float32)
+    features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-9)
+
+    vectors = np.hstack([grams, features * FEATURE_WEIGHT])
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+    return vectors
+
+
+def _row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class StyleStore:
+    """プロセス間で共有できる文体ルールのライブラリ"""
+
+    def __init__(self, path=DEFAULT_STYLE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = _row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS styles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                rules TEXT NOT NULL,
+                source_hash TEXT NOT NULL UNIQUE,
+                source_excerpt TEXT NOT NULL,
+                model TEXT,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS styles_name ON styles(name)")
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._matrix = np.zeros((0, NGRAM_DIMS + len(profile_batch(["-"])[0])), dtype=np.float32)
+        self._data_version = None
+        self._reload()
+
+    # --- 索引 (メモリ上のベクトル行列) ----------------------------------
+    def _reload(self):
+        rows = self._conn.execute("SELECT id, vector FROM styles ORDER BY id").fetchall()
+        self._ids = np.array([r["id"] for r in rows], dtype=np.int64)
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(r["vector"], dtype=np.float32) for r in rows])
+        else:
+            self._matrix = self._matrix[:0]
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()["data_version"]
+
+    def _sync(self):
+        # 他プロセスが書き込んだ場合のみ data_version が変わるので、そのときだけ読み直す
+        version = self._conn.execute("PRAGMA data_version").fetchone()["data_version"]
+        if version != self._data_version:
+            self._reload()
+
+    def _index_upsert(self, style_id, vector):
+        pos = np.searchsorted(self._ids, style_id)
+        if pos < len(self._ids) and self._ids[pos] == style_id:
+            self._matrix[pos] = vector
+        else:
+            self._ids = np.insert(self._ids, pos, style_id)
+            self._matrix = np.insert(self._matrix, pos, vector, axis=0)
+
+    # --- 保存・取得 ------------------------------------------------------
+    def add(self, rules, source_text, model=None, name=None):
+        """ルールを保存して ID を返す。同じ元メールのスタイルがあれば上書きする"""
+        vector = style_vectors([source_text])[0]
+        digest = source_hash(source_text)
+        now = time.time()
+        with self._lock:
+            self._sync()
+            self._conn.execute(
+                """INSERT INTO styles (name, rules, source_hash, source_excerpt, model, vector, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(source_hash) DO UPDATE SET
+                    rules = excluded.rules, model = excluded.model, vector = excluded.vector,
+                    name = COALESCE(excluded.name, styles.name), updated_at = excluded.updated_at""",
+                (name, rules, digest, source_text[:500], model, vector.tobytes(), now, now),
+            )
+            style_id = self._conn.execute("SELECT id FROM styles WHERE source_hash = ?", (digest,)).fetchone()["id"]
+            self._index_upsert(style_id, vector)
+        return style_id
+
+    def add_many(self, records):
+        """(rules, source_text, model, name) のリストをまとめて保存する (ベクトル化も一括で行う)"""
+        records = list(records)
+        if not records:
+            return
+        vectors = style_vectors([r[1] for r in records])
+        now = time.time()
+        rows = [
+            (name, rules, source_hash(text), text[:500], model, vector.tobytes(), now, now)
+            for (rules, text, model, name), vector in zip(records, vectors)
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                """INSERT INTO styles (name, rules, source_hash, source_excerpt, model, vector, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(source_hash) DO UPDATE SET
+                    rules = excluded.rules, model = excluded.model, vector = excluded.vector,
+                    name = COALESCE(excluded.name, styles.name), updated_at = excluded.updated_at""",
+                rows,
+            )
+            self._conn.execute("COMMIT")
+            self._reload()
+
+    def set_name(self, style_id, name):
+        with self._lock:
+            self._conn.execute("UPDATE styles SET name = ?, updated_at = ? WHERE id = ?", (name, time.time(), style_id))
+
+    def get(self, style_id):
+        with self._lock:
+            return self._get(style_id)
+
+    def _get(self, style_id):
+        return self._conn.execute(
+            "SELECT id, name, rules, source_excerpt, model, created_at, updated_at FROM styles WHERE id = ?",
+            (style_id,),
+        ).fetchone()
+
+    def delete(self, style_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM styles WHERE id = ?", (style_id,))
+            self._reload()
+
+    def list_named(self, query="", limit=50):
+        """名前付きのスタイルを新しい順に返す (query で名前を部分一致検索。% や _ も普通の文字として扱う)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, name, model, created_at, updated_at FROM styles "
+                "WHERE name IS NOT NULL AND instr(name, ?) > 0 ORDER BY updated_at DESC LIMIT ?",
+                (query, limit),
+            ).fetchall()
+
+    def __len__(self):
+        return len(self._ids)
+
+    # --- 類似検索 --------------------------------------------------------
+    def find_similar(self, text, min_score=0.0):
+        """text に最も近い保存済みスタイルを (style, 類似度) で返す。min_score 未満なら None
+
+        元メールが完全一致するスタイルは類似度 1.0 として優先する。
+        """
+        vector = style_vectors([text])[0]
+        with self._lock:
+            exact = self._conn.execute(
+                "SELECT id FROM styles WHERE source_hash = ?", (source_hash(text),)
+            ).fetchone()
+            if exact is not None:
+                return self._get(exact["id"]), 1.0
+
+            self._sync()
+            if len(self._ids) == 0:
+                return None
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score < min_score:
+                return None
+            style = self._get(int(self._ids[best]))
+        return (style, score) if style is not None else None
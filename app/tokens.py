@@ -0,0 +1,7 @@
+"""トークン数の簡易見積もり (tokenizer を使わない概算)"""
+
+
+def estimate_tokens(text):
+    """日本語 (CJK) は 1 文字 ≒ 1 トークン、それ以外は 4 文字 ≒ 1 トークンとして概算する"""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
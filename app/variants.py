@@ -0,0 +1,71 @@
+"""複数バリエーション・複数依頼のメール一括生成"""
+import csv
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from llm import chat_completion
+from metrics import start_call
+
+DEFAULT_CONCURRENCY = 4
+HEADER_WORDS = ("宛先", "依頼", "内容", "recipient", "request")
+
+
+def parse_request_table(text):
+    """貼り付けられた表 (タブ区切りまたはカンマ区切り) を [{"recipient", "request"}] に変換する
+
+    2 列以上なら 1 列目を宛先、残りを依頼内容とし、1 列なら依頼内容のみとして扱う。
+    見出し行 (宛先・依頼内容 など) は読み飛ばす。
+    """
+    rows = []
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return rows
+    delimiter = "\t" if "\t" in lines[0] else ","
+    for i, cells in enumerate(csv.reader(lines, delimiter=delimiter)):
+        cells = [cell.strip() for cell in cells]
+        if i == 0 and len(cells) > 1 and any(word in cells[0] + cells[1] for word in HEADER_WORDS):
+            continue
+        if len(cells) == 1:
+            rows.append({"recipient": "", "request": cells[0]})
+        elif cells:
+            rows.append({"recipient": cells[0], "request": delimiter.join(cells[1:]).strip()})
+    return [row for row in rows if row["request"]]
+
+
+def _generate(client, model, messages, metrics, **kwargs):
+    return chat_completion(client, model=model, messages=messages, record=start_call(metrics, "generate_batch", model), **kwargs)
+
+
+def generate_many(client, model, message_list, concurrency=DEFAULT_CONCURRENCY, cache=None, bypass_cache=False,
+                  metrics=None, **params):
+    """message_list の各リクエストを最大 concurrency 並列で実行し、完了順に (番号, Completion) を返す
+
+    失敗したリクエストは Completion の代わりに例外オブジェクトを返す。
+    途中で打ち切られた場合は未着手のリクエストを取り消す。
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        futures = {
+            pool.submit(
+                _generate, client, model, messages, metrics,
+                cache=cache, bypass_cache=bypass_cache, **params
+            ): i
+            for i, messages in enumerate(message_list)
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def bundle_zip(emails):
+    """[(ファイル名, 本文)] を 1 つの zip (bytes) にまとめる"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, body in emails:
+            zf.writestr(name, body)
+    return buffer.getvalue()
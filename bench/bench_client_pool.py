@@ -0,0 +1,77 @@
+"""リクエストごとに OpenAI クライアントを作る場合と ClientPool を使う場合のレイテンシ比較
+
+    python bench/bench_client_pool.py --requests 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from openai import OpenAI  # noqa: E402
+
+from client_pool import ClientPool  # noqa: E402
+from llm import SYSTEM_GENERATE, build_messages  # noqa: E402
+from mock_openai import start_server  # noqa: E402
+
+MESSAGES = build_messages(SYSTEM_GENERATE, "会議の日程変更のお知らせ")
+
+
+def _measure(get_client, requests):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        client = get_client()
+        client.chat.completions.create(model="gpt-4.1", messages=MESSAGES)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def _summary(latencies):
+    return {
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(statistics.quantiles(latencies, n=20)[18], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--base-url", help="既存のサーバーを使う場合の URL (省略時はローカルのスタンドインを起動)")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = start_server()
+
+    def fresh_client():
+        # 従来の実装: ボタンを押すたびに OpenAI(api_key=...) を作る
+        return OpenAI(api_key="sk-bench", base_url=base_url)
+
+    pool = ClientPool()
+
+    def pooled_client():
+        return pool.get("sk-bench", base_url)
+
+    _measure(pooled_client, 5)  # ウォームアップ
+    fresh = _summary(_measure(fresh_client, args.requests))
+    pooled = _summary(_measure(pooled_client, args.requests))
+    pool.close()
+    if server is not None:
+        server.shutdown()
+
+    print(json.dumps({
+        "requests": args.requests,
+        "fresh_client": fresh,
+        "pooled_client": pooled,
+        "saved_mean_ms": round(fresh["mean_ms"] - pooled["mean_ms"], 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
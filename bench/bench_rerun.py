@@ -0,0 +1,63 @@
+"""Streamlit スクリプトのコールドスタート時間と再実行時間の計測
+
+    python bench/bench_rerun.py --reruns 30 --cold-runs 3
+
+コールドスタートは毎回新しいプロセスで計測する (モジュールの import を含む)。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "email_style_extractor.py")
+
+
+def child(reruns):
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.run()
+    cold_ms = (time.perf_counter() - started) * 1000
+    openai_loaded = "openai" in sys.modules
+
+    samples = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - started) * 1000)
+    print(json.dumps({"cold_ms": cold_ms, "reruns_ms": samples, "openai_imported_at_startup": openai_loaded}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reruns", type=int, default=30)
+    parser.add_argument("--cold-runs", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.reruns)
+        return
+
+    results = []
+    for _ in range(args.cold_runs):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--reruns", str(args.reruns)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    reruns = sorted(ms for r in results for ms in r["reruns_ms"])
+    print(json.dumps({
+        "cold_start_ms_p50": round(statistics.median(r["cold_ms"] for r in results), 1),
+        "rerun_ms_p50": round(statistics.median(reruns), 2),
+        "rerun_ms_p95": round(reruns[min(len(reruns) - 1, int(len(reruns) * 0.95))], 2),
+        "openai_imported_at_startup": any(r["openai_imported_at_startup"] for r in results),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
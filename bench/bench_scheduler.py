@@ -0,0 +1,90 @@
+"""429 / 500 を注入したスタンドインに対する、スケジューラなし・ありの成功率とスループット比較
+
+    python bench/bench_scheduler.py --users 4 --threads-per-user 4 --requests 10 --error-rate 0.2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from client_pool import ClientPool  # noqa: E402
+from llm import SYSTEM_GENERATE, build_messages, chat_completion  # noqa: E402
+from mock_openai import start_server  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+MESSAGES = build_messages(SYSTEM_GENERATE, "会議の日程変更のお知らせ")
+
+
+def _run(get_client, users, threads_per_user, requests):
+    counts = {"ok": 0, "failed": 0}
+    finished = {}
+    lock = threading.Lock()
+
+    def worker(user):
+        client = get_client(user)
+        for _ in range(requests):
+            try:
+                chat_completion(client, model="gpt-4.1", messages=MESSAGES, max_tokens=200)
+                outcome = "ok"
+            except Exception:
+                outcome = "failed"
+            with lock:
+                counts[outcome] += 1
+                finished[user] = time.perf_counter()
+
+    threads = [
+        threading.Thread(target=worker, args=(f"user{u}",))
+        for u in range(users) for _ in range(threads_per_user)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    total = counts["ok"] + counts["failed"]
+    return {
+        "succeeded": counts["ok"],
+        "failed": counts["failed"],
+        "success_rate": round(counts["ok"] / total, 4),
+        "elapsed_sec": round(elapsed, 3),
+        "ok_per_sec": round(counts["ok"] / elapsed, 2),
+        # 利用者ごとの完了時刻のばらつき (小さいほど公平)
+        "user_finish_spread_sec": round(max(finished.values()) - min(finished.values()), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--threads-per-user", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=10, help="スレッドあたりのリクエスト数")
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rpm", type=float, default=1200)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency, error_rate=args.error_rate, seed=7)
+    pool = ClientPool(max_retries=0)
+    scheduler = Scheduler(rpm=args.rpm)
+
+    direct = _run(lambda user: pool.get("sk-bench", base_url), args.users, args.threads_per_user, args.requests)
+    scheduled = _run(
+        lambda user: scheduler.client(pool.get("sk-bench", base_url), user),
+        args.users, args.threads_per_user, args.requests,
+    )
+    pool.close()
+    server.shutdown()
+    print(json.dumps({
+        "config": vars(args),
+        "direct": direct,
+        "scheduled": dict(scheduled, **{f"scheduler_{k}": v for k, v in scheduler.stats().items()}),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
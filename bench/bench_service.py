@@ -0,0 +1,157 @@
+"""HTTP サービス (app/service.py) の負荷試験。スタンドインの API に向けたワーカーを起動して叩く
+
+    python bench/bench_service.py --workers 2 --concurrency 64 --duration 10 --endpoint generate
+    python bench/bench_service.py --workers 1 --endpoint stream --latency 0.2 --token-delay 0.005
+
+結果は 1 秒あたりのリクエスト数と、それをワーカーに割り当てられる CPU コア数で割った値 (req/s/core)。
+応答キャッシュは既定で無効にし、すべてのリクエストがスタンドインまで届くようにする。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+sys.path.insert(0, APP_DIR)
+
+from mock_openai import start_server  # noqa: E402
+
+STYLE_RULES = "\n".join(f"- ルール{i}" for i in range(10))
+EMAIL = "お世話になっております。\n来週の打ち合わせの件でご連絡いたしました。\nよろしくお願いいたします。\n\n山田"
+PAYLOADS = {
+    "extract": ("/v1/extract", {"email": EMAIL, "model": "gpt-4o-mini"}),
+    "generate": ("/v1/generate", {
+        "style_rules": STYLE_RULES, "request": "会議の日程変更のお知らせ", "purpose": "スケジュール調整",
+        "formality": 4, "length": "短め", "model": "gpt-4o-mini", "max_tokens": 200,
+    }),
+}
+PAYLOADS["stream"] = ("/v1/generate/stream", PAYLOADS["generate"][1])
+
+
+def _free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def start_service(host, port, workers, base_url, cache):
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench")
+    if not cache:
+        env["MAIL_GPT_SERVICE_NO_CACHE"] = "1"
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(APP_DIR, "service.py"), "--host", host, "--port", str(port),
+         "--workers", str(workers), "--allow-env-key"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://{host}:{port}/healthz", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("サービスの起動に失敗しました")
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("サービスが起動しませんでした")
+
+
+async def _request(client, endpoint):
+    path, payload = PAYLOADS[endpoint]
+    if endpoint != "stream":
+        response = await client.post(path, json=payload)
+        return response.status_code == 200
+    async with client.stream("POST", path, json=payload) as response:
+        done = False
+        async for line in response.aiter_lines():
+            if line.startswith("data: ") and '"done"' in line:
+                done = True
+        return response.status_code == 200 and done
+
+
+async def load(base_url, endpoint, concurrency, duration, warmup):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies = []
+    counts = {"ok": 0, "failed": 0}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for _ in range(warmup):
+            await _request(client, endpoint)
+        stop = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                try:
+                    ok = await _request(client, endpoint)
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                counts["ok" if ok else "failed"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": counts["ok"] + counts["failed"],
+        "failed": counts["failed"],
+        "elapsed_sec": round(elapsed, 3),
+        "requests_per_sec": round(counts["ok"] / elapsed, 2),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=sorted(PAYLOADS), default="generate")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="スタンドインの応答待ち時間 (秒)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="ストリーミングの断片ごとの待ち時間 (秒)")
+    parser.add_argument("--cache", action="store_true", help="サービスの応答キャッシュを有効にする")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--output", help="結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    server, mock_url = start_server(args.host, latency=args.latency, token_delay=args.token_delay)
+    port = _free_port(args.host)
+    proc = start_service(args.host, port, args.workers, mock_url, args.cache)
+    try:
+        result = asyncio.run(load(
+            f"http://{args.host}:{port}", args.endpoint, args.concurrency, args.duration, args.warmup
+        ))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        server.shutdown()
+
+    # ワーカーが使えるコア数 (ワーカー数が CPU 数を超えても 1 コアあたりの値は上がらない)
+    cores = min(args.workers, os.cpu_count() or 1)
+    result.update({
+        "endpoint": args.endpoint,
+        "workers": args.workers,
+        "concurrency": args.concurrency,
+        "cores": cores,
+        "requests_per_sec_per_core": round(result["requests_per_sec"] / cores, 2),
+        "upstream_requests": server.stats["requests"],
+    })
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""StyleStore.find_similar の検索レイテンシ計測
+
+    python bench/bench_style_store.py --styles 20000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from style_store import StyleStore  # noqa: E402
+
+OPENINGS = ["拝啓", "いつもお世話になっております。", "お疲れ様です。", "こんにちは！", "平素より格別のご高配を賜り、厚く御礼申し上げます。"]
+BODIES = [
+    "先日の打ち合わせの資料をお送りいたします。", "来週の会議の日程を変更させてください。",
+    "ご注文いただいた商品の納期についてご連絡します。", "イベントへのご参加ありがとうございました！",
+    "四半期レポートの進捗をご報告いたします。", "ご確認のほどよろしくお願いいたします。",
+]
+CLOSINGS = ["敬具", "よろしくお願いいたします。", "よろしくね！", "何卒よろしくお願い申し上げます。"]
+
+
+def synthetic_email(rng, i):
+    body = "\n".join(rng.sample(BODIES, 3))
+    return f"{rng.choice(OPENINGS)}\n案件{i}について\n{body}\n{rng.choice(CLOSINGS)}\n担当{i}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--styles", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StyleStore(os.path.join(tmp, "styles.sqlite3"))
+        started = time.perf_counter()
+        for offset in range(0, args.styles, 5000):
+            batch = range(offset, min(offset + 5000, args.styles))
+            store.add_many([("- ルール", synthetic_email(rng, i), "bench", None) for i in batch])
+        load_sec = time.perf_counter() - started
+
+        latencies = []
+        for i in range(args.queries):
+            query = synthetic_email(rng, args.styles + i)
+            t = time.perf_counter()
+            store.find_similar(query)
+            latencies.append((time.perf_counter() - t) * 1000)
+
+    print(json.dumps({
+        "styles": args.styles,
+        "load_sec": round(load_sec, 2),
+        "lookup_p50_ms": round(statistics.median(latencies), 3),
+        "lookup_p95_ms": round(statistics.quantiles(latencies, n=20)[18], 3),
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""ローカル文体特徴量 (stylometry.profile_batch) のスループット計測
+
+    python bench/bench_stylometry.py --emails 10000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from stylometry import profile_batch  # noqa: E402
+
+SAMPLES = [
+    "拝啓\n\n平素より格別のご高配を賜り、厚く御礼申し上げます。\n株式会社〇〇の山田太郎でございます。\n\n"
+    "ご要望いただいた資料を添付させていただきます。\nご不明な点がございましたら、お気軽にお問い合わせください。\n\n敬具",
+    "こんにちは山田さん\n\n先日はありがとうございました！\n打ち合わせの件ですが、来週の水曜日15時からでよろしいでしょうか？\n\n"
+    "ご都合を教えてくださいm(_ _)m\nよろしくお願いします！\n\n田中",
+    "部長\n\n四半期レポートの進捗状況をご報告いたします。\n\n【完了項目】\n・売上データの集計\n・前年同期との比較分析\n\n"
+    "【作業中】\n・グラフ作成と考察（70%完了）\n\n週末までには完成版をお送りできる見込みです。\n\n伊藤",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = [SAMPLES[i % len(SAMPLES)] + f"\n{i}" for i in range(args.emails)]
+    best = float("inf")
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        profile_batch(texts)
+        best = min(best, time.perf_counter() - started)
+    print(json.dumps({"emails": args.emails, "best_sec": round(best, 4), "emails_per_sec": round(args.emails / best, 1)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""ベンチマーク用のローカル Chat Completions スタンドインサーバー
+
+    python bench/mock_openai.py --port 8765 --latency 0.05 --token-delay 0.005 --error-rate 0.05
+
+OPENAI_BASE_URL=http://127.0.0.1:8765/v1 を指定すればアプリや CLI をそのまま向けられる。
+stream=True のリクエストには SSE で TOKEN_CHARS 文字ずつ返し、error_rate の割合で 429 / 500 を返す。
+入力トークンは 1 文字 = 1 トークンとして数え、OpenAI のプロンプトキャッシュと同様に、PROMPT_CACHE_MIN 以上の
+プロンプトの先頭から PROMPT_CACHE_BLOCK 単位で以前のリクエストと一致した分を cached_tokens として返す。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STYLE_RULES = "\n".join(f"- 文体ルール {i + 1}: 文末は「です・ます」で統一する。" for i in range(10))
+EMAIL_BODY = "件名: ご連絡\n\n○○様\n\nいつもお世話になっております。\nご確認のほどよろしくお願いいたします。\n\n山田"
+TOKEN_CHARS = 4  # ストリーミング時に 1 チャンクで返す文字数
+PROMPT_CACHE_MIN = 1024
+PROMPT_CACHE_BLOCK = 128
+
+
+def _reply_text(body):
+    system = body["messages"][0]["content"] if body.get("messages") else ""
+    return STYLE_RULES if "analyst" in system else EMAIL_BODY
+
+
+def _prompt_text(body):
+    return "".join(m.get("content", "") for m in body.get("messages", []))
+
+
+def _cached_prefix(prompt, seen):
+    """prompt の先頭から、以前のリクエストと一致したブロックの文字数を返し、今回のブロックを seen に加える"""
+    if len(prompt) < PROMPT_CACHE_MIN:
+        return 0
+    cached = 0
+    matching = True
+    for end in range(PROMPT_CACHE_BLOCK, len(prompt) + 1, PROMPT_CACHE_BLOCK):
+        key = hash(prompt[:end])
+        if matching and key in seen:
+            cached = end
+        else:
+            matching = False
+            seen.add(key)
+    return cached
+
+
+def _usage(body, text, cached=0):
+    prompt_chars = len(_prompt_text(body))
+    completion_tokens = len(text) // TOKEN_CHARS * body.get("n", 1)
+    return {
+        "prompt_tokens": prompt_chars,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_chars + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # 既定の 5 では並列計測時に接続が拒否される
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive を有効にする
+    disable_nagle_algorithm = True  # ヘッダーと本文の分割送信で遅延 ACK 待ちにならないようにする
+    latency = 0.0       # 応答 (ストリーミングなら最初のトークン) までの待ち時間
+    jitter = 0.0        # latency に加える一様乱数の幅
+    token_delay = 0.0   # ストリーミング時のトークン間隔
+    error_rate = 0.0
+    rng = random.Random(0)
+    stats = None
+    stats_lock = None
+    prompt_cache = None  # 送られたプロンプトの接頭辞 (ブロック単位) のハッシュ
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=()):
+        out = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self._count("requests")
+        time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+        if self.rng.random() < self.error_rate:
+            self._count("errors")
+            if self.rng.random() < 0.5:
+                self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}},
+                                headers=[("Retry-After", "0")])
+            else:
+                self._send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+            return
+
+        text = _reply_text(body)
+        n = body.get("n", 1)
+        with self.stats_lock:
+            cached = _cached_prefix(_prompt_text(body), self.prompt_cache)
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body.get("model", "mock")}
+        if not body.get("stream"):
+            self._send_json(200, dict(
+                base,
+                object="chat.completion",
+                choices=[
+                    {"index": i, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                    for i in range(n)
+                ],
+                usage=_usage(body, text, cached),
+            ))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for start in range(0, len(text), TOKEN_CHARS):
+                for i in range(n):
+                    chunk = dict(base, object="chat.completion.chunk", choices=[
+                        {"index": i, "delta": {"content": text[start:start + TOKEN_CHARS]}, "finish_reason": None}
+                    ])
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = dict(base, object="chat.completion.chunk", choices=[], usage=_usage(body, text, cached))
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントがストリームを途中で閉じた
+            self._count("cancelled")
+            self.close_connection = True
+
+
+def start_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, token_delay=0.0, error_rate=0.0, seed=0):
+    """サーバーを別スレッドで起動し (server, base_url) を返す。port=0 なら空きポート
+
+    server.stats にリクエスト数・エラー注入数・途中切断数が入る。
+    """
+    stats = {"requests": 0, "errors": 0, "cancelled": 0}
+    handler = type("Handler", (MockHandler,), {
+        "latency": latency,
+        "jitter": jitter,
+        "token_delay": token_delay,
+        "error_rate": error_rate,
+        "rng": random.Random(seed),
+        "stats": stats,
+        "stats_lock": threading.Lock(),
+        "prompt_cache": set(),
+    })
+    server = MockServer((host, port), handler)
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ローカル Chat Completions スタンドイン")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答 (最初のトークン) までの待ち時間 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="待ち時間に加える乱数の幅 (秒)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="ストリーミング時のトークン間隔 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429 / 500 を返す割合 (0〜1)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    server, base_url = start_server(
+        args.host, args.port, args.latency, args.jitter, args.token_delay, args.error_rate, args.seed
+    )
+    print(f"listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,233 @@
+"""ローカルのスタンドインサーバーに対するエンドツーエンドのベンチマーク
+
+    python bench/run_bench.py --output bench_results.json
+    python bench/run_bench.py --baseline bench_results.json --tolerance 0.15
+
+スタイル抽出・メール生成 (ストリーミング)・並列一括抽出・エラー注入時の挙動と、
+テンプレートのレンダリングコストを計測し、フラットな JSON の metrics に書き出す。
+--baseline を指定すると各指標を比較し、許容幅を超えて悪化したものがあれば終了コード 1 を返す。
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import numpy as np  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+from assets import SAMPLE_EMAILS  # noqa: E402
+from batch_cli import run_batch  # noqa: E402
+from client_pool import ClientPool  # noqa: E402
+from llm import SYSTEM_EXTRACT, SYSTEM_GENERATE, achat_completion, build_messages, chat_completion, stream_chat_completion  # noqa: E402
+from mock_openai import start_server  # noqa: E402
+from prompt_templates import EMAIL_PURPOSES, render_generate_prompt, render_style_prompt  # noqa: E402
+
+SAMPLE_TEXTS = list(SAMPLE_EMAILS.values())
+STYLE_RULES = "\n".join(f"- ルール{i}" for i in range(10))
+# プロンプトキャッシュの下限 (1024 トークン) を超える、コーパスから抽出したような詳細な文体ルール
+DETAILED_STYLE_RULES = "\n".join(
+    f"- ルール{i}: 文末は「です・ます」で統一し、依頼の前には相手の状況を気遣う一文を置く" for i in range(24)
+)
+# 値が大きいほど良い指標 (それ以外は小さいほど良い)
+HIGHER_IS_BETTER = ("_per_sec", "success_rate", "cached_ratio")
+# 計測の揺らぎとして無視する絶対差 (単位の接尾辞ごと)。基準値がごく小さい指標が相対変化だけで悪化と判定されないようにする
+NOISE_FLOOR = {"_us": 5.0, "_ms": 1.0}
+
+
+def percentiles(prefix, samples, unit="ms"):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {f"{prefix}.p50_{unit}": round(float(p50), 3), f"{prefix}.p95_{unit}": round(float(p95), 3),
+            f"{prefix}.p99_{unit}": round(float(p99), 3)}
+
+
+def bench_render(iterations):
+    metrics = {}
+    style, generate = [], []
+    for i in range(iterations):
+        text = SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]
+        t = time.perf_counter()
+        render_style_prompt(text)
+        style.append((time.perf_counter() - t) * 1e6)
+        t = time.perf_counter()
+        render_generate_prompt(STYLE_RULES, "会議の日程変更のお知らせ", purpose=EMAIL_PURPOSES[i % len(EMAIL_PURPOSES)])
+        generate.append((time.perf_counter() - t) * 1e6)
+    metrics.update(percentiles("render.style_prompt", style, "us"))
+    metrics.update(percentiles("render.generate_prompt", generate, "us"))
+    return metrics
+
+
+def bench_extract(client, requests):
+    latencies = []
+    for i in range(requests):
+        messages = build_messages(SYSTEM_EXTRACT, render_style_prompt(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]))
+        t = time.perf_counter()
+        chat_completion(client, model="gpt-4.1", messages=messages, temperature=0.3)
+        latencies.append((time.perf_counter() - t) * 1000)
+    return percentiles("extract.latency", latencies)
+
+
+def bench_generate_stream(client, requests):
+    ttft, total = [], []
+    for i in range(requests):
+        prompt = render_generate_prompt(STYLE_RULES, f"会議の日程変更のお知らせ {i}")
+        t = time.perf_counter()
+        first = None
+        for _ in stream_chat_completion(client, model="gpt-4.1", messages=build_messages(SYSTEM_GENERATE, prompt)):
+            if first is None:
+                first = time.perf_counter()
+        ttft.append((first - t) * 1000)
+        total.append((time.perf_counter() - t) * 1000)
+    metrics = percentiles("generate_stream.ttft", ttft)
+    metrics.update(percentiles("generate_stream.total", total))
+    return metrics
+
+
+def bench_prompt_cache(client, requests):
+    """同じ文体ルールで依頼内容だけを変えて生成し、入力トークンのうちキャッシュに一致した割合を求める"""
+    prompt_tokens = cached_tokens = 0
+    for i in range(requests):
+        prompt = render_generate_prompt(
+            DETAILED_STYLE_RULES, f"会議の日程変更のお知らせ {i}", purpose=EMAIL_PURPOSES[i % 3]
+        )
+        res = chat_completion(client, model="gpt-4.1", messages=build_messages(SYSTEM_GENERATE, prompt))
+        prompt_tokens += res.usage["prompt_tokens"]
+        cached_tokens += res.usage.get("cached_tokens", 0)
+    return {"prompt_cache.cached_ratio": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0}
+
+
+def bench_concurrent(base_url, records, concurrency):
+    class NullWriter:
+        next_index = 0
+
+        def put(self, index, record):
+            self.next_index = index + 1
+
+    async def run():
+        client = AsyncOpenAI(api_key="sk-bench", base_url=base_url, max_retries=0)
+
+        async def worker(record):
+            messages = build_messages(SYSTEM_EXTRACT, render_style_prompt(record["text"]))
+            res = await achat_completion(client, model="gpt-4.1", messages=messages, temperature=0.3)
+            return {"id": record["id"], "style_rules": res.content}
+
+        items = [{"id": str(i), "text": SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} for i in range(records)]
+        started = time.perf_counter()
+        ok, failed = await run_batch(iter(items), worker, NullWriter(), concurrency)
+        elapsed = time.perf_counter() - started
+        await client.close()
+        return ok, failed, elapsed
+
+    ok, failed, elapsed = asyncio.run(run())
+    return {
+        f"concurrent_c{concurrency}.emails_per_sec": round((ok + failed) / elapsed, 2),
+        f"concurrent_c{concurrency}.failed": failed,
+    }
+
+
+def bench_errors(base_url, requests):
+    pool = ClientPool()
+    client = pool.get("sk-bench", base_url)
+    latencies, succeeded = [], 0
+    for i in range(requests):
+        messages = build_messages(SYSTEM_EXTRACT, render_style_prompt(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]))
+        t = time.perf_counter()
+        try:
+            chat_completion(client, model="gpt-4.1", messages=messages)
+            succeeded += 1
+        except Exception:
+            pass
+        latencies.append((time.perf_counter() - t) * 1000)
+    pool.close()
+    metrics = percentiles("error_injection.latency", latencies)
+    metrics["error_injection.success_rate"] = round(succeeded / requests, 4)
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    """ベースラインより tolerance を超えて悪化した指標を [(名前, 基準値, 今回値)] で返す
+
+    基準値が 0 の指標は、小さいほど良いものだけが 0 を超えた時点で悪化とみなす (失敗数など)。
+    """
+    regressions = []
+    for name, value in metrics.items():
+        base = baseline.get(name)
+        if not isinstance(base, (int, float)) or not isinstance(value, (int, float)):
+            continue
+        floor = next((v for suffix, v in NOISE_FLOOR.items() if name.endswith(suffix)), 0.0)
+        if abs(value - base) <= floor:
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            worse = value < base * (1 - tolerance)
+        else:
+            worse = value > base * (1 + tolerance)
+        if worse:
+            regressions.append((name, base, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのスタンドインサーバーに対するベンチマーク")
+    parser.add_argument("--requests", type=int, default=50, help="逐次計測のリクエスト数")
+    parser.add_argument("--records", type=int, default=200, help="並列計測のレコード数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="スタンドインの応答待ち時間 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--error-rate", type=float, default=0.2, help="エラー注入シナリオでの 429/500 の割合")
+    parser.add_argument("--render-iterations", type=int, default=2000)
+    parser.add_argument("--output", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--baseline", help="比較するベースラインの JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="悪化とみなす相対変化 (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency, jitter=args.jitter, token_delay=args.token_delay)
+    error_server, error_url = start_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=1)
+    pool = ClientPool()
+    client = pool.get("sk-bench", base_url)
+
+    metrics = {}
+    metrics.update(bench_render(args.render_iterations))
+    metrics.update(bench_extract(client, args.requests))
+    metrics.update(bench_generate_stream(client, args.requests))
+    metrics.update(bench_prompt_cache(client, args.requests))
+    metrics.update(bench_concurrent(base_url, args.records, 1))
+    metrics.update(bench_concurrent(base_url, args.records, args.concurrency))
+    metrics.update(bench_errors(error_url, args.requests))
+    pool.close()
+    server.shutdown()
+    error_server.shutdown()
+
+    result = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "metrics": metrics,
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["metrics"]
+        regressions = compare(metrics, baseline, args.tolerance)
+        for name, base, value in regressions:
+            print(f"REGRESSION {name}: {base} -> {value}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
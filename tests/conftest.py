@@ -0,0 +1,7 @@
+import os
+import sys
+
+# app/ のモジュールはフラットに import される (bench/ と同じ方法で参照する)。bench/ はスタンドインサーバー用
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "app"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
@@ -0,0 +1,85 @@
+import asyncio
+import io
+import json
+
+from batch_cli import OrderedWriter, load_done_ids, main_async, parse_args, read_jsonl, run_batch
+from mock_openai import start_server
+
+
+def _lines(fp):
+    return [json.loads(line) for line in fp.getvalue().splitlines()]
+
+
+def test_ordered_writer_writes_in_input_order():
+    fp = io.StringIO()
+    writer = OrderedWriter(fp)
+    writer.put(2, {"id": "c"})
+    writer.put(1, {"id": "b"})
+    assert fp.getvalue() == ""
+    writer.put(0, {"id": "a"})
+    assert [r["id"] for r in _lines(fp)] == ["a", "b", "c"]
+    assert writer.next_index == 3
+
+
+def test_run_batch_keeps_order_and_records_errors():
+    async def worker(record):
+        # 後のレコードほど早く終わるようにして、完了順と入力順をずらす
+        await asyncio.sleep(0.01 * (5 - int(record["id"])))
+        if record["id"] == "3":
+            raise ValueError("boom")
+        return {"id": record["id"], "ok": True}
+
+    fp = io.StringIO()
+    records = ({"id": str(i)} for i in range(6))
+    ok, failed = asyncio.run(run_batch(records, worker, OrderedWriter(fp), concurrency=3))
+    rows = _lines(fp)
+    assert (ok, failed) == (5, 1)
+    assert [r["id"] for r in rows] == [str(i) for i in range(6)]
+    assert rows[3]["error"] == "ValueError: boom"
+
+
+def test_load_done_ids_skips_errors_and_truncated_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(
+        '{"id": "a", "style_rules": "x"}\n'
+        '{"id": "b", "error": "RateLimitError: 429"}\n'
+        '{"id": "c", "style_ru',
+        encoding="utf-8",
+    )
+    assert load_done_ids(str(path)) == {"a"}
+    assert load_done_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_read_jsonl_fills_id_and_text(tmp_path):
+    path = tmp_path / "in.jsonl"
+    path.write_text('{"email": "本文"}\n\n{"id": 7, "text": "t"}\n', encoding="utf-8")
+    assert list(read_jsonl(str(path))) == [
+        {"email": "本文", "id": "0", "text": "本文"},
+        {"id": "7", "text": "t"},
+    ]
+
+
+def test_resume_skips_completed_records(tmp_path, monkeypatch):
+    server, base_url = start_server()
+    monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    mails = tmp_path / "mails"
+    mails.mkdir()
+    for name in ("a.txt", "b.txt", "c.txt"):
+        (mails / name).write_text(f"{name} の本文です。", encoding="utf-8")
+    output = tmp_path / "out.jsonl"
+    output.write_text('{"id": "a.txt", "style_rules": "done"}\n{"id": "b.txt", "error": "APIConnectionError"}\n',
+                      encoding="utf-8")
+    try:
+        args = parse_args(["extract", "--input", str(mails), "--output", str(output), "--no-cache"])
+        summary = asyncio.run(main_async(args))
+    finally:
+        server.shutdown()
+
+    assert (summary["processed"], summary["failed"], summary["skipped"]) == (2, 0, 1)
+    assert server.stats["requests"] == 2
+    rows = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    # 失敗していた b.txt は再処理した結果だけが残る
+    assert [r["id"] for r in rows] == ["a.txt", "b.txt", "c.txt"]
+    assert "error" not in rows[1] and rows[0]["style_rules"] == "done"
+    assert load_done_ids(str(output)) == {"a.txt", "b.txt", "c.txt"}
@@ -0,0 +1,78 @@
+from cascade import CascadeStats, cascade_tiers, run_cascade, validate_rules
+from llm import Completion
+
+SOURCE = "お世話になっております。来週の打ち合わせの日程についてご相談させてください。候補日は火曜と木曜です。"
+GOOD = "\n".join(f"- 文体ルール {i}: 丁寧語で簡潔に書く" for i in range(10))
+
+
+def test_validate_rules_accepts_well_formed_rules():
+    assert validate_rules(GOOD, SOURCE) == []
+
+
+def test_validate_rules_reports_line_count_and_prefix():
+    problems = validate_rules("- 一行だけ\n二行目", SOURCE)
+    assert any("行数が 2 行" in p for p in problems)
+    assert any("2 行目" in p and "始まっていません" in p for p in problems)
+
+
+def test_validate_rules_detects_copied_source():
+    copied = GOOD + "\n- 来週の打ち合わせの日程についてご相談させてください"
+    problems = validate_rules(copied, SOURCE)
+    assert problems == ["11 行目がメール本文の転載です"]
+
+
+def test_cascade_tiers():
+    assert cascade_tiers("gpt-4o-mini") == ["gpt-4o-mini"]
+    assert cascade_tiers("gpt-4.1") == ["gpt-4o-mini", "gpt-4.1"]
+
+
+def test_run_cascade_escalates_only_on_failure():
+    calls = []
+
+    def attempt(model):
+        calls.append(model)
+        return Completion("bad" if model == "small" else GOOD)
+
+    def validate(text):
+        return validate_rules(text, SOURCE)
+
+    stats = CascadeStats()
+    res, model, history = run_cascade(["small", "large"], attempt, validate, stats)
+    assert (res.content, model, calls) == (GOOD, "large", ["small", "large"])
+    assert history[0][1] and history[1] == ("large", [])
+    summary = stats.summary()
+    assert summary["tiers"]["small"]["success_rate"] == 0.0
+    assert summary["tiers"]["large"]["passed"] == 1
+    assert summary["requests"] == 1
+
+    calls.clear()
+    res, model, _ = run_cascade(["large", "small"], attempt, validate)
+    assert (model, calls) == ("large", ["large"])
+
+
+def test_run_cascade_keeps_last_tier_even_if_invalid():
+    res, model, history = run_cascade(["a", "b"], lambda m: Completion("x"), lambda text: ["ng"])
+    assert (res.content, model, len(history)) == ("x", "b", 2)
+
+
+def test_cached_results_are_not_counted():
+    stats = CascadeStats()
+    run_cascade(["a"], lambda m: Completion(GOOD, cached=True), lambda text: [], stats)
+    assert stats.summary() == {"tiers": {}, "requests": 0, "baseline_ms": {}, "mean_saved_ms": None}
+
+
+def test_saved_time_is_measured_against_single_model_runs():
+    stats = CascadeStats()
+    # 軽量モデルが常に合格しても、上位モデル単独の所要時間と比べて短縮時間を出す
+    stats.record_attempt("small", True, 100.0)
+    stats.record_request("large", 100.0)
+    assert stats.summary()["mean_saved_ms"] is None
+    stats.record_baseline("large", 400.0)
+    stats.record_baseline("large", 200.0)
+    summary = stats.summary()
+    assert summary["baseline_ms"] == {"large": 300.0}
+    assert summary["mean_saved_ms"] == 200.0
+
+    run_cascade(["large"], lambda m: Completion(GOOD), lambda text: [], stats)
+    summary = stats.summary()
+    assert len(summary["baseline_ms"]) == 1 and "large" not in summary["tiers"]
@@ -0,0 +1,63 @@
+import time
+
+from history import HistoryStore, SessionHistory
+
+
+def _requests(entries):
+    return [e.request for e in entries]
+
+
+def test_page_spans_memory_and_disk():
+    history = SessionHistory(HistoryStore(":memory:"), "s1", memory_limit=3)
+    for i in range(8):
+        history.add(f"依頼 {i}", f"本文 {i}")
+    assert len(history) == 8
+    entries, total = history.page(0, page_size=4)
+    assert total == 8
+    assert _requests(entries) == ["依頼 7", "依頼 6", "依頼 5", "依頼 4"]
+    assert _requests(history.page(1, page_size=4)[0]) == ["依頼 3", "依頼 2", "依頼 1", "依頼 0"]
+    assert history.page(2, page_size=4)[0] == []
+
+
+def test_entries_round_trip_compressed_body():
+    history = SessionHistory(HistoryStore(":memory:"), "s1", memory_limit=1)
+    history.add("a", "本文 A")
+    history.add("b", "本文 B")  # a はディスクへ移る
+    entries, _ = history.page(0, page_size=10)
+    assert [e.email for e in entries] == ["本文 B", "本文 A"]
+
+
+def test_query_filters_both_tiers():
+    history = SessionHistory(HistoryStore(":memory:"), "s1", memory_limit=2)
+    for request in ("会議の件", "請求書", "会議の変更", "お礼", "会議室"):
+        history.add(request, "本文")
+    entries, total = history.page(0, page_size=10, query="会議")
+    assert total == 3
+    assert _requests(entries) == ["会議室", "会議の変更", "会議の件"]
+
+
+def test_query_is_literal_and_case_sensitive_in_both_tiers():
+    history = SessionHistory(HistoryStore(":memory:"), "s1", memory_limit=1)
+    for request in ("50% off", "500 円", "a_b", "axb", "Meeting", "meeting"):
+        history.add(request, "本文")
+    assert _requests(history.page(0, query="%")[0]) == ["50% off"]
+    assert _requests(history.page(0, query="_")[0]) == ["a_b"]
+    entries, total = history.page(0, query="meeting")
+    assert (_requests(entries), total) == (["meeting"], 1)
+    entries, total = history.page(0, query="Meeting")
+    assert (_requests(entries), total) == (["Meeting"], 1)
+
+
+def test_sessions_are_isolated_and_old_rows_expire(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    store = HistoryStore(path)
+    mine = SessionHistory(store, "mine", memory_limit=1)
+    other = SessionHistory(store, "other", memory_limit=1)
+    for i in range(3):
+        mine.add(f"mine {i}", "x")
+        other.add(f"other {i}", "x")
+    assert _requests(mine.page(0, page_size=10)[0]) == ["mine 2", "mine 1", "mine 0"]
+    assert store.count("other") == 2
+
+    store._conn.execute("UPDATE history SET ts = ?", (time.time() - 3600,))
+    assert HistoryStore(path, max_age=60).count("mine") == 0
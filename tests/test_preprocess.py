@@ -0,0 +1,74 @@
+from preprocess import MESSAGE_SEPARATOR, minhash, preprocess_email
+from tokens import estimate_tokens
+
+SIGNATURE = "--\n山田 太郎\n株式会社サンプル 営業部\nyamada@example.com"
+
+
+def test_reply_history_and_quotes_are_dropped():
+    text = (
+        "山田です。資料をお送りします。\n> 以前の引用\nよろしくお願いします。\n\n"
+        "-----Original Message-----\nFrom: 田中\n田中です。資料をください。\n"
+        "---\n"
+        "山田です。会議の件、了解しました。\n\n"
+        "On Mon, Jan 1, 2024 at 10:00 AM Tanaka wrote:\n田中です。会議は明日です。\n"
+    )
+    result = preprocess_email(text)
+    assert result.text == (
+        "山田です。資料をお送りします。\nよろしくお願いします。" + MESSAGE_SEPARATOR + "山田です。会議の件、了解しました。"
+    )
+    assert "田中" not in result.text
+    assert result.messages == 2
+    assert result.quoted_lines == 6
+
+
+def test_duplicate_messages_and_signatures_are_removed():
+    first = "お世話になっております。\n先日の件、承知しました。\n\n" + SIGNATURE
+    second = "お世話になっております。\n来週の会議に参加します。\n\n" + SIGNATURE
+    result = preprocess_email("\n---\n".join([first, second, first]))
+    assert result.duplicates == 1
+    assert result.signatures == 1
+    assert result.text.count("山田 太郎") == 1
+    assert result.messages == 2
+
+
+def test_near_duplicates_are_detected():
+    body = "お世話になっております。" + "".join(f"項目{i}について確認しました。" for i in range(20))
+    assert (minhash(body) == minhash(body + "以上")).mean() >= 0.8
+    result = preprocess_email(body + "\n---\n" + body + "以上")
+    assert result.duplicates == 1
+
+
+def test_legal_footer_is_removed_but_signature_kept():
+    text = "ご確認ください。\n\n" + SIGNATURE + "\n\n本メールの内容は機密情報を含みます。誤って受信された場合は削除してください。"
+    result = preprocess_email(text)
+    assert "機密" not in result.text
+    assert "山田 太郎" in result.text
+
+
+def test_body_mentioning_confidentiality_is_kept():
+    text = (
+        "田中様\n\nいつもお世話になっております。\n来週の会議では機密保持契約の件をご相談させてください。\n"
+        "ご都合をお知らせいただけますと幸いです。\n\nよろしくお願いいたします。\n山田"
+    )
+    assert preprocess_email(text).text == text
+    # 署名がない場合は、定型文らしい段落でも取り除かない
+    text = "ご確認ください。\n\n本メールの内容は機密情報を含みます。"
+    assert preprocess_email(text).text == text
+
+
+def test_budget_keeps_whole_messages_and_none_disables_it():
+    messages = [f"メール{i}。" + "あ" * 100 for i in range(5)]
+    text = "\n---\n".join(messages)
+    limited = preprocess_email(text, token_budget=250)
+    assert limited.truncated and limited.messages == 2
+    assert limited.tokens_after <= 250
+    unlimited = preprocess_email(text, token_budget=None)
+    assert not unlimited.truncated and unlimited.messages == 5
+
+
+def test_oversized_single_line_is_cut_by_characters():
+    result = preprocess_email("あ" * 500, token_budget=100)
+    assert result.truncated
+    assert 0 < estimate_tokens(result.text) <= 100
+    result = preprocess_email("word " * 500, token_budget=100)
+    assert 0 < estimate_tokens(result.text) <= 100
@@ -0,0 +1,100 @@
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+from scheduler import (
+    Scheduler, TokenBucket, _Lane, _SettlingStream, _Ticket, estimate_request_tokens, is_retryable, retry_after
+)
+
+
+def _enqueue(lane, user, tokens=1):
+    ticket = _Ticket(user, tokens)
+    lane.queues.setdefault(user, deque()).append(ticket)
+    return ticket
+
+
+def test_lane_grants_round_robin_between_users():
+    lane = _Lane(rpm=1000, tpm=1000000)
+    for _ in range(3):
+        _enqueue(lane, "heavy")
+    _enqueue(lane, "light")
+    order = []
+    while (ticket := lane.next_ticket()) is not None:
+        order.append(ticket.user)
+        lane.grant(ticket)
+    assert order == ["heavy", "light", "heavy", "heavy"]
+    assert not lane.queues
+
+
+def test_lane_position_counts_tickets_granted_first():
+    lane = _Lane(rpm=1000, tpm=1000000)
+    heavy = [_enqueue(lane, "heavy") for _ in range(3)]
+    light = [_enqueue(lane, "light") for _ in range(2)]
+    assert lane.position(heavy[0]) == 0
+    assert lane.position(light[0]) == 1  # heavy の 1 件目の後
+    assert lane.position(heavy[1]) == 2  # heavy 1 件目・light 1 件目の後
+    assert lane.position(light[1]) == 3
+    assert lane.position(heavy[2]) == 4
+
+
+def test_token_bucket_wait_time_and_cap():
+    bucket = TokenBucket(60)  # 1 秒に 1 ずつ補充
+    now = bucket._updated
+    bucket.take(60)
+    assert bucket.wait_time(2, now) == pytest.approx(2.0)
+    # 容量を超える要求は満杯になるまで待てば取り出せる
+    assert bucket.wait_time(1000, now) == pytest.approx(60.0)
+    bucket.give_back(1000)
+    assert bucket.level == 60
+
+
+def test_estimate_request_tokens_reserves_output_per_choice():
+    messages = [{"role": "user", "content": "あいう"}]
+    assert estimate_request_tokens(messages, max_tokens=10, n=2) == 3 + 20
+
+
+class _RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after_value):
+        super().__init__("429")
+        self.response = SimpleNamespace(headers={"retry-after": retry_after_value})
+
+
+def test_call_retries_after_rate_limit_and_pauses_lane():
+    scheduler = Scheduler(rpm=1000, tpm=1000000, max_retries=2)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _RateLimited("0")
+        return "ok"
+
+    assert scheduler.call("key", "model", "user", 10, fn) == "ok"
+    stats = scheduler.stats()
+    assert (stats["granted"], stats["retries"], stats["throttled"], stats["failed"]) == (2, 1, 1, 0)
+
+
+def test_call_does_not_retry_client_errors():
+    scheduler = Scheduler(max_retries=3)
+    error = ValueError("bad request")
+
+    def fn():
+        raise error
+
+    with pytest.raises(ValueError):
+        scheduler.call("key", "model", "user", 10, fn)
+    assert scheduler.stats()["retries"] == 0
+    assert scheduler.stats()["failed"] == 1
+    assert not is_retryable(error)
+    assert retry_after(_RateLimited("1.5")) == 1.5
+
+
+def test_settling_stream_settles_once_from_usage_chunk():
+    settled = []
+    chunks = [SimpleNamespace(usage=None), SimpleNamespace(usage=SimpleNamespace(total_tokens=42))]
+    stream = _SettlingStream(iter(chunks), settled.append)
+    assert list(stream) == chunks
+    assert settled == [42]